@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Hashable, Optional
+
+from loguru import logger
+
+# Отпечаток альбома: (количество фото, id самого нового фото)
+Fingerprint = tuple[int, Optional[int]]
+
+
+@dataclass
+class AlbumListing:
+    fingerprint: Fingerprint
+    total: int
+    photos: list
+    checked_at: float = field(default_factory=time.monotonic)
+
+
+class AlbumListingCache:
+    """
+    In-memory кэш списков фото альбомов с TTL.
+    Пока запись свежая, она отдается без запросов к ВК; устаревшую
+    вызывающий код перепроверяет по отпечатку и продлевает через touch().
+    Суммарный размер ограничен числом фото, вытесняются давно не запрошенные альбомы.
+    """
+
+    def __init__(self, ttl: float, max_photos: int):
+        self.ttl = ttl
+        self.max_photos = max_photos
+        self._entries: OrderedDict[Hashable, AlbumListing] = OrderedDict()
+        self._size = 0
+
+    def get(self, key: Hashable) -> Optional[AlbumListing]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def is_fresh(self, entry: AlbumListing) -> bool:
+        return time.monotonic() - entry.checked_at < self.ttl
+
+    @staticmethod
+    def touch(entry: AlbumListing):
+        entry.checked_at = time.monotonic()
+
+    def put(self, key: Hashable, fingerprint: Fingerprint, total: int, photos: list):
+        if len(photos) > self.max_photos:
+            return
+        self.drop(key)
+        self._entries[key] = AlbumListing(fingerprint=fingerprint, total=total, photos=photos)
+        self._size += len(photos)
+
+        while self._size > self.max_photos:
+            old_key, old_entry = self._entries.popitem(last=False)
+            self._size -= len(old_entry.photos)
+            logger.debug(f"AlbumListingCache: вытеснен альбом {old_key}")
+
+    def drop(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry.photos)
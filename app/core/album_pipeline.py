@@ -0,0 +1,211 @@
+import asyncio
+from typing import AsyncIterable, AsyncIterator, Callable, Optional, Union
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InputMediaPhoto, BufferedInputFile
+from loguru import logger
+
+from app.core.config import get_settings
+from app.core.file_id_cache import FileIdCache
+from app.core.http_client import download_file
+from app.core.image_processing import ImageProcessor
+from app.core.metrics import INFLIGHT_BYTES, STAGE_SECONDS
+from app.core.rate_limiter import RateLimiter
+from app.core.vk_service import PhotoRecord
+
+MEDIA_GROUP_SIZE = 10
+
+
+# Фото для медиагруппы: file_id из кэша (str) или скачанные байты
+Media = Union[str, bytes]
+
+
+async def _fetch_media(photo: PhotoRecord, semaphore: asyncio.Semaphore,
+                       use_file_ids: bool, profile: str, max_bytes: Optional[int]) -> Media:
+    """Уже отправленное фото берем по file_id из кэша, остальные скачиваем."""
+    if use_file_ids:
+        file_id = FileIdCache.get(photo.cache_key)
+        if file_id:
+            return file_id
+    async with semaphore:
+        data = await download_file(photo.url, max_bytes)
+    # Слишком крупные для Telegram оригиналы ужимаем, иначе вся медиагруппа не уйдет
+    data = await ImageProcessor.process(data, profile)
+    # Байты живут в памяти, пока пачку не отправят (см. iter_download_batches)
+    INFLIGHT_BYTES.inc(len(data))
+    return data
+
+
+def _media_bytes(items: list[tuple[PhotoRecord, Media]]) -> int:
+    return sum(len(media) for _, media in items if isinstance(media, bytes))
+
+
+def _discard(photo: PhotoRecord, task: asyncio.Task):
+    """Отменяет загрузку, которую уже не отправим; скачанные байты списываем."""
+    if task.done() and not task.cancelled() and task.exception() is None:
+        INFLIGHT_BYTES.dec(_media_bytes([(photo, task.result())]))
+    task.cancel()
+
+
+async def iter_download_batches(
+        photos: AsyncIterable[PhotoRecord],
+        batch_size: int = MEDIA_GROUP_SIZE,
+        concurrency: int = None,
+        prefetch_batches: int = None,
+        use_file_ids: bool = True,
+        profile: str = None,
+        on_failed: Callable[[PhotoRecord, Exception], None] = None,
+        max_bytes: int = None,
+) -> AsyncIterator[list[tuple[PhotoRecord, Media]]]:
+    """
+    Конвейер скачивания для отправки медиагруппами.
+
+    Держит пул параллельных загрузок и скачивает следующие пачки,
+    пока вызывающий код отправляет текущую. Пачки отдаются строго
+    в порядке альбома, а память ограничена окном из
+    (prefetch_batches + 1) * batch_size фото.
+    Источник фото — асинхронный (например, VKService.iter_photos),
+    поэтому отправка начинается, не дожидаясь конца сканирования.
+    Отдает списки (фото, file_id или байты); не скачавшиеся фото пропускаются
+    и передаются в on_failed вместе с ошибкой.
+    use_file_ids=False и profile="" дают только исходные байты (например, для архива);
+    max_bytes — предел размера одного фото (по умолчанию DOWNLOAD_MAX_BYTES).
+    """
+    settings = get_settings()
+    concurrency = concurrency or settings.DOWNLOAD_CONCURRENCY
+    if prefetch_batches is None:
+        prefetch_batches = settings.DOWNLOAD_PREFETCH_BATCHES
+    if profile is None:
+        profile = settings.IMAGE_PROFILE_GET_ALBUM
+
+    semaphore = asyncio.Semaphore(concurrency)
+    # Окно загрузок заполняет фоновая задача: если источник ждет следующую
+    # страницу сканирования, уже скачанная пачка отдается, не дожидаясь ВК
+    window: asyncio.Queue[Optional[tuple[PhotoRecord, asyncio.Task]]] = asyncio.Queue(
+        batch_size * (prefetch_batches + 1)
+    )
+    source_error: Optional[Exception] = None
+
+    async def fill_window():
+        nonlocal source_error
+        try:
+            async for photo in photos:
+                task = asyncio.create_task(_fetch_media(photo, semaphore, use_file_ids, profile, max_bytes))
+                try:
+                    await window.put((photo, task))
+                except asyncio.CancelledError:
+                    _discard(photo, task)
+                    raise
+        except Exception as e:
+            source_error = e
+        await window.put(None)
+
+    filler = asyncio.create_task(fill_window())
+    batch = []
+    try:
+        while (item := await window.get()) is not None:
+            photo, task = item
+            try:
+                data = await task
+            except Exception as e:
+                # Ошибка одного фото не роняет весь альбом
+                logger.warning(f"Pipeline: не удалось скачать {photo.url}: {e}")
+                if on_failed:
+                    on_failed(photo, e)
+                continue
+
+            batch.append((photo, data))
+            if len(batch) == batch_size:
+                yield batch
+                INFLIGHT_BYTES.dec(_media_bytes(batch))
+                batch = []
+
+        if source_error is not None:
+            raise source_error
+        if batch:
+            yield batch
+            INFLIGHT_BYTES.dec(_media_bytes(batch))
+            batch = []
+    finally:
+        # Отмена отправки (или ошибка) — не оставляем висящих загрузок
+        filler.cancel()
+        await asyncio.gather(filler, return_exceptions=True)
+        INFLIGHT_BYTES.dec(_media_bytes(batch))
+        while not window.empty():
+            item = window.get_nowait()
+            if item is not None:
+                _discard(*item)
+
+
+def _build_media_group(batch: list[tuple[PhotoRecord, Media]]) -> list[InputMediaPhoto]:
+    return [
+        InputMediaPhoto(media=media if isinstance(media, str) else BufferedInputFile(
+            media, filename=f"p_{photo.owner_id}_{photo.id}.jpg"
+        ))
+        for photo, media in batch
+    ]
+
+
+async def _send_group(message: types.Message, batch: list[tuple[PhotoRecord, Media]]) -> list[types.Message]:
+    media_group = _build_media_group(batch)
+    return await RateLimiter.telegram(
+        message.chat.id, lambda: message.answer_media_group(media=media_group), cost=len(media_group)
+    )
+
+
+def _is_stale_file_id(error: Exception) -> bool:
+    """Telegram не знает file_id (удален или от другого бота) — только тогда запись кэша негодна."""
+    text = str(error).lower()
+    return isinstance(error, TelegramBadRequest) and ("file identifier" in text or "file_id" in text)
+
+
+async def send_media_batch(message: types.Message, batch: list[tuple[PhotoRecord, Media]],
+                           on_failed: Callable[[PhotoRecord, Exception], None] = None) -> list[PhotoRecord]:
+    """
+    Отправляет пачку медиагруппой и запоминает полученные file_id; возвращает отправленные фото.
+    Если Telegram не принял закэшированный file_id, сбрасываем эти записи
+    и один раз переотправляем пачку со свежескачанными фото. Фото, которые
+    при этом не скачались, в пачку не попадают и передаются в on_failed.
+    Прочие ошибки (сеть, 5xx, флуд) пробрасываем: кэш тут ни при чем.
+    """
+    try:
+        async with STAGE_SECONDS.time(stage="telegram_send"):
+            sent = await _send_group(message, batch)
+    except TelegramBadRequest as e:
+        cached = [photo for photo, media in batch if isinstance(media, str)]
+        if not cached or not _is_stale_file_id(e):
+            raise
+        logger.warning(f"Pipeline: file_id из кэша не принят ({e}), переотправляем с загрузкой")
+        FileIdCache.delete_many([photo.cache_key for photo in cached])
+
+        semaphore = asyncio.Semaphore(get_settings().DOWNLOAD_CONCURRENCY)
+        profile = get_settings().IMAGE_PROFILE_GET_ALBUM
+
+        async def refresh(photo: PhotoRecord, media: Media) -> Media:
+            if isinstance(media, bytes):
+                return media
+            async with semaphore:
+                data = await download_file(photo.url)
+            return await ImageProcessor.process(data, profile)
+
+        results = await asyncio.gather(*(refresh(photo, media) for photo, media in batch), return_exceptions=True)
+        refreshed = []
+        for (photo, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Pipeline: не удалось скачать {photo.url}: {result}")
+                if on_failed:
+                    on_failed(photo, result)
+            else:
+                refreshed.append((photo, result))
+        batch = refreshed
+        if not batch:
+            return []
+        sent = await _send_group(message, batch)
+
+    FileIdCache.put_many({
+        photo.cache_key: msg.photo[-1].file_id
+        for (photo, media), msg in zip(batch, sent)
+        if isinstance(media, bytes) and msg.photo
+    })
+    return [photo for photo, _ in batch]
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from typing import Optional
+
+from loguru import logger
+
+# Запас на служебные записи ZIP (заголовки файлов и центральный каталог)
+ZIP_ENTRY_OVERHEAD = 128
+ZIP_TAIL_RESERVE = 64 * 1024
+# Запас на имя файла в архиве (оно пишется дважды: в заголовке и в каталоге)
+ZIP_NAME_RESERVE = 2 * 1024
+
+
+@dataclass
+class ZipVolume:
+    path: str
+    filename: str
+    files: int
+
+
+class ZipVolumeWriter:
+    """
+    Пишет фото в ZIP-архивы на диске по мере скачивания, разбивая их на тома
+    не больше max_bytes. В памяти держится только текущее фото.
+    JPEG уже сжат, поэтому файлы кладутся без сжатия (ZIP_STORED).
+    """
+
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.part = 0
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._path: Optional[str] = None
+        self._size = 0
+        self._files = 0
+
+    @property
+    def max_file_bytes(self) -> int:
+        """Самый большой файл, который еще помещается в том вместе со служебными записями."""
+        return self.max_bytes - ZIP_TAIL_RESERVE - ZIP_ENTRY_OVERHEAD - ZIP_NAME_RESERVE
+
+    def _open_volume(self):
+        self.part += 1
+        fd, self._path = tempfile.mkstemp(prefix=f"{self.name}_", suffix=".zip")
+        os.close(fd)
+        self._zip = zipfile.ZipFile(self._path, "w", compression=zipfile.ZIP_STORED)
+        self._size = ZIP_TAIL_RESERVE
+        self._files = 0
+
+    def add(self, arcname: str, data: bytes) -> Optional[ZipVolume]:
+        """Добавляет файл. Если текущий том переполнился бы, закрывает его и возвращает готовым."""
+        entry_size = len(data) + ZIP_ENTRY_OVERHEAD + 2 * len(arcname)
+        finished = None
+        if self._zip is not None and self._files and self._size + entry_size > self.max_bytes:
+            finished = self.close()
+        if self._zip is None:
+            self._open_volume()
+
+        self._zip.writestr(arcname, data)
+        self._size += entry_size
+        self._files += 1
+        return finished
+
+    def close(self) -> Optional[ZipVolume]:
+        """Закрывает текущий том (если он есть) и возвращает его."""
+        if self._zip is None:
+            return None
+        self._zip.close()
+        volume = ZipVolume(path=self._path, filename=f"{self.name}_part{self.part}.zip", files=self._files)
+        self._zip = None
+        self._path = None
+        return volume
+
+    def discard(self):
+        """Удаляет незаконченный том (отмена или ошибка)."""
+        if self._zip is not None:
+            self._zip.close()
+            remove_volume(self._path)
+            self._zip = None
+            self._path = None
+
+
+def remove_volume(path: str):
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.warning(f"Archive: не удалось удалить {path}: {e}")
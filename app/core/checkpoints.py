@@ -0,0 +1,461 @@
+import asyncio
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from loguru import logger
+
+from app.core.config import get_settings
+from app.core.database import open_db
+from app.core.vk_service import AlbumInfo, PhotoPage, PhotoRecord, VKService
+
+# Сколько фото снимка читаем с диска за раз
+SNAPSHOT_CHUNK = 1000
+# Причина ошибки в чекпоинте — коротко, для отчета пользователю
+MAX_REASON_LENGTH = 200
+# Чекпоинт принадлежит процессу, который его ведет; тот продлевает аренду раз в LEASE_RENEW_INTERVAL.
+# Если аренда не продлевалась LEASE_SECONDS, владелец считается упавшим и чекпоинт можно забрать
+LEASE_SECONDS = 60.0
+LEASE_RENEW_INTERVAL = 15.0
+
+
+@dataclass
+class AlbumState:
+    """Альбом в составе отправки и его прогресс."""
+    info: AlbumInfo
+    # Сканирование альбома закончено (успешно или с ошибкой error)
+    scanned: bool = False
+    error: str = ''
+    # Фото альбома в снимке (без дублей из других альбомов) и уже отправленные
+    found: int = 0
+    done: int = 0
+
+    @property
+    def expected(self) -> int:
+        return self.found if self.scanned else max(self.info.size, self.found)
+
+
+@dataclass
+class Transfer:
+    """
+    Чекпоинт отправки одного или нескольких альбомов одним потоком.
+    Все фото с индексом < delivered уже разобраны: отправлены или записаны
+    в неудачные (с причиной).
+    """
+    id: str
+    albums: list[AlbumState]
+    mode: str
+    quality: str
+    # Исходное сообщение пользователя (JSON): по нему задача восстанавливается после рестарта
+    message: str
+    # Сколько фото уже в снимке на диске
+    scanned: int = 0
+    delivered: int = 0
+    # Отправлено фото и ZIP-томов (нумерация томов продолжается после рестарта)
+    done: int = 0
+    parts: int = 0
+
+    @property
+    def scan_complete(self) -> bool:
+        return all(album.scanned for album in self.albums)
+
+    @property
+    def total(self) -> int:
+        """Сколько фото будет всего: точно — после сканирования, до него — по размерам альбомов."""
+        return sum(album.expected for album in self.albums)
+
+
+def _reason(error: BaseException) -> str:
+    return f"{type(error).__name__}: {error}"[:MAX_REASON_LENGTH]
+
+
+def _photo(owner_id: int, photo_id: int, size: str, url: str) -> PhotoRecord:
+    return PhotoRecord(owner_id, photo_id, url=url, size=size)
+
+
+class TransferStore:
+    """
+    Чекпоинты отправки альбомов (Singleton на SQLite): альбомы и их состояние,
+    снимок списка фото, граница доставленного и неудачные фото с причинами.
+    Чекпоинт удаляется, когда задача завершена или отменена пользователем;
+    оставшиеся после рестарта подхватывает resume_album_transfers.
+    База общая для воркеров и реплик на машине, поэтому у чекпоинта есть владелец
+    с арендой: продолжить можно только брошенный (аренда истекла или освобождена).
+    """
+    _conn: sqlite3.Connection = None
+    _owner: str = ''
+    _lease_task: asyncio.Task = None
+
+    @classmethod
+    def open(cls):
+        if cls._conn is not None:
+            return
+        cls._conn = open_db(
+            "transfers.sqlite3",
+            "CREATE TABLE IF NOT EXISTS transfers ("
+            " id TEXT PRIMARY KEY, mode TEXT NOT NULL, quality TEXT NOT NULL, message TEXT NOT NULL,"
+            " scanned INTEGER NOT NULL, delivered INTEGER NOT NULL, done INTEGER NOT NULL,"
+            " parts INTEGER NOT NULL, updated REAL NOT NULL,"
+            " owner TEXT NOT NULL DEFAULT '', heartbeat REAL NOT NULL DEFAULT 0)",
+            "CREATE TABLE IF NOT EXISTS transfer_albums ("
+            " transfer_id TEXT NOT NULL, idx INTEGER NOT NULL, owner_id INTEGER NOT NULL,"
+            " album_id TEXT NOT NULL, title TEXT NOT NULL, size INTEGER NOT NULL,"
+            " scanned INTEGER NOT NULL, error TEXT NOT NULL, PRIMARY KEY (transfer_id, idx))",
+            "CREATE TABLE IF NOT EXISTS transfer_photos ("
+            " transfer_id TEXT NOT NULL, idx INTEGER NOT NULL, album INTEGER NOT NULL,"
+            " owner_id INTEGER NOT NULL, photo_id INTEGER NOT NULL, size TEXT NOT NULL, url TEXT NOT NULL,"
+            " PRIMARY KEY (transfer_id, idx))",
+            "CREATE TABLE IF NOT EXISTS transfer_failed ("
+            " transfer_id TEXT NOT NULL, idx INTEGER NOT NULL, reason TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL, PRIMARY KEY (transfer_id, idx))"
+        )
+        # Базы, созданные до появления аренды
+        columns = {row[1] for row in cls._conn.execute("PRAGMA table_info(transfers)")}
+        if "owner" not in columns:
+            with cls._conn:
+                cls._conn.execute("ALTER TABLE transfers ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+                cls._conn.execute("ALTER TABLE transfers ADD COLUMN heartbeat REAL NOT NULL DEFAULT 0")
+        cls._owner = uuid.uuid4().hex
+        cls._lease_task = asyncio.create_task(cls._renew_leases())
+        logger.info("TransferStore: Открыт.")
+
+    @classmethod
+    def close(cls):
+        if cls._lease_task:
+            cls._lease_task.cancel()
+            cls._lease_task = None
+        if cls._conn:
+            # Свои чекпоинты отпускаем сразу: после рестарта их не придется ждать LEASE_SECONDS
+            try:
+                with cls._conn:
+                    cls._conn.execute("UPDATE transfers SET heartbeat = 0 WHERE owner = ?", (cls._owner,))
+            except sqlite3.Error as e:
+                logger.warning(f"TransferStore: не удалось освободить чекпоинты: {e}")
+            cls._conn.close()
+            cls._conn = None
+            logger.info("TransferStore: Закрыт.")
+
+    @classmethod
+    async def _renew_leases(cls):
+        while True:
+            await asyncio.sleep(LEASE_RENEW_INTERVAL)
+            try:
+                with cls._conn:
+                    cls._conn.execute(
+                        "UPDATE transfers SET heartbeat = ? WHERE owner = ?", (time.time(), cls._owner)
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"TransferStore: не удалось продлить аренду: {e}")
+
+    @classmethod
+    def create(cls, transfer: Transfer):
+        if cls._conn is None:
+            return
+        with cls._conn:
+            cls._conn.execute(
+                "INSERT OR IGNORE INTO transfers"
+                " (id, mode, quality, message, scanned, delivered, done, parts, updated, owner, heartbeat)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (transfer.id, transfer.mode, transfer.quality, transfer.message, transfer.scanned,
+                 transfer.delivered, transfer.done, transfer.parts, time.time(), cls._owner, time.time())
+            )
+            cls._conn.executemany(
+                "INSERT OR IGNORE INTO transfer_albums"
+                " (transfer_id, idx, owner_id, album_id, title, size, scanned, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(transfer.id, i, a.info.owner_id, a.info.album_id, a.info.title, a.info.size, int(a.scanned), a.error)
+                 for i, a in enumerate(transfer.albums)]
+            )
+
+    @classmethod
+    def claim_abandoned(cls) -> list[Transfer]:
+        """Брошенные чекпоинты (аренда истекла): закрепляет их за этим процессом и возвращает."""
+        if cls._conn is None:
+            return []
+        now = time.time()
+        rows = cls._conn.execute(
+            "SELECT id, mode, quality, message, scanned, delivered, done, parts FROM transfers"
+            " WHERE heartbeat < ? ORDER BY updated", (now - LEASE_SECONDS,)
+        ).fetchall()
+        claimed = []
+        for row in rows:
+            with cls._conn:
+                # Другой процесс мог забрать чекпоинт между SELECT и UPDATE
+                taken = cls._conn.execute(
+                    "UPDATE transfers SET owner = ?, heartbeat = ? WHERE id = ? AND heartbeat < ?",
+                    (cls._owner, now, row[0], now - LEASE_SECONDS)
+                ).rowcount
+            if taken:
+                claimed.append(cls._load(*row))
+        return claimed
+
+    @classmethod
+    def release(cls, transfer_id: str):
+        """Отпускает чекпоинт: его подхватит следующий проход resume_album_transfers."""
+        if cls._conn is None:
+            return
+        with cls._conn:
+            cls._conn.execute("UPDATE transfers SET heartbeat = 0 WHERE id = ? AND owner = ?", (transfer_id, cls._owner))
+
+    @classmethod
+    def _load(cls, transfer_id: str, mode: str, quality: str, message: str,
+              scanned: int, delivered: int, done: int, parts: int) -> Transfer:
+        albums = [
+            AlbumState(AlbumInfo(owner_id, album_id, title=title, size=size), scanned=bool(album_scanned), error=error)
+            for owner_id, album_id, title, size, album_scanned, error in cls._conn.execute(
+                "SELECT owner_id, album_id, title, size, scanned, error FROM transfer_albums"
+                " WHERE transfer_id = ? ORDER BY idx", (transfer_id,)
+            )
+        ]
+        # Счетчики по альбомам выводим из снимка, отдельно их не храним
+        for album, found, sent in cls._conn.execute(
+            "SELECT album, COUNT(*), SUM(idx < ? AND idx NOT IN"
+            " (SELECT idx FROM transfer_failed WHERE transfer_id = ?))"
+            " FROM transfer_photos WHERE transfer_id = ? GROUP BY album",
+            (delivered, transfer_id, transfer_id)
+        ):
+            albums[album].found = found
+            albums[album].done = sent or 0
+        return Transfer(transfer_id, albums, mode, quality, message, scanned, delivered, done, parts)
+
+    @classmethod
+    def save(cls, transfer: Transfer):
+        """Сохраняет счетчики прогресса."""
+        if cls._conn is None:
+            return
+        with cls._conn:
+            cls._conn.execute(
+                "UPDATE transfers SET scanned = ?, delivered = ?, done = ?, parts = ?, updated = ? WHERE id = ?",
+                (transfer.scanned, transfer.delivered, transfer.done, transfer.parts, time.time(), transfer.id)
+            )
+
+    @classmethod
+    def save_album(cls, transfer: Transfer, index: int):
+        if cls._conn is None:
+            return
+        album = transfer.albums[index]
+        with cls._conn:
+            cls._conn.execute(
+                "UPDATE transfer_albums SET size = ?, scanned = ?, error = ? WHERE transfer_id = ? AND idx = ?",
+                (album.info.size, int(album.scanned), album.error, transfer.id, index)
+            )
+
+    @classmethod
+    def delete(cls, transfer_id: str):
+        if cls._conn is None:
+            return
+        with cls._conn:
+            cls._conn.execute("DELETE FROM transfers WHERE id = ?", (transfer_id,))
+            for table in ("transfer_albums", "transfer_photos", "transfer_failed"):
+                cls._conn.execute(f"DELETE FROM {table} WHERE transfer_id = ?", (transfer_id,))
+
+    # --- СНИМОК АЛЬБОМОВ ---
+    @classmethod
+    def append_photos(cls, transfer: Transfer, album: int, photos: list[PhotoRecord]):
+        """Дописывает фото альбома в снимок и сохраняет прогресс сканирования."""
+        if cls._conn is None or not photos:
+            return
+        with cls._conn:
+            cls._conn.executemany(
+                "INSERT OR REPLACE INTO transfer_photos (transfer_id, idx, album, owner_id, photo_id, size, url)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(transfer.id, transfer.scanned + i, album, p.owner_id, p.id, p.size, p.url)
+                 for i, p in enumerate(photos)]
+            )
+        transfer.scanned += len(photos)
+        cls.save(transfer)
+
+    @classmethod
+    def snapshot(cls, transfer_id: str, start: int, limit: int) -> list[tuple[int, int, PhotoRecord]]:
+        """Фото снимка начиная с индекса start: [(индекс, альбом, фото)]."""
+        if cls._conn is None:
+            return []
+        rows = cls._conn.execute(
+            "SELECT idx, album, owner_id, photo_id, size, url FROM transfer_photos"
+            " WHERE transfer_id = ? AND idx >= ? ORDER BY idx LIMIT ?",
+            (transfer_id, start, limit)
+        ).fetchall()
+        return [(idx, album, _photo(*photo)) for idx, album, *photo in rows]
+
+    @classmethod
+    def snapshot_keys(cls, transfer_id: str) -> set[tuple[int, int]]:
+        """Фото, уже попавшие в снимок: досканирование после рестарта их пропускает."""
+        if cls._conn is None:
+            return set()
+        return set(cls._conn.execute(
+            "SELECT owner_id, photo_id FROM transfer_photos WHERE transfer_id = ?", (transfer_id,)
+        ))
+
+    # --- НЕУДАЧНЫЕ ФОТО ---
+    @classmethod
+    def fail(cls, transfer_id: str, idx: int, reason: str):
+        if cls._conn is None:
+            return
+        with cls._conn:
+            cls._conn.execute(
+                "INSERT INTO transfer_failed (transfer_id, idx, reason, attempts) VALUES (?, ?, ?, 1)"
+                " ON CONFLICT (transfer_id, idx) DO UPDATE SET reason = excluded.reason, attempts = attempts + 1",
+                (transfer_id, idx, reason)
+            )
+
+    @classmethod
+    def resolve(cls, transfer_id: str, indexes: list[int]):
+        """Фото все-таки ушли после повтора."""
+        if cls._conn is None or not indexes:
+            return
+        with cls._conn:
+            cls._conn.executemany(
+                "DELETE FROM transfer_failed WHERE transfer_id = ? AND idx = ?", [(transfer_id, i) for i in indexes]
+            )
+
+    @classmethod
+    def retry_candidates(cls, transfer: Transfer, max_attempts: int) -> list[tuple[int, int, PhotoRecord]]:
+        """
+        Неудачные фото, которые стоит повторить. Неудачи за границей delivered забываем:
+        эти фото и так пойдут заново из снимка.
+        """
+        if cls._conn is None:
+            return []
+        with cls._conn:
+            cls._conn.execute(
+                "DELETE FROM transfer_failed WHERE transfer_id = ? AND idx >= ?", (transfer.id, transfer.delivered)
+            )
+        rows = cls._conn.execute(
+            "SELECT p.idx, p.album, p.owner_id, p.photo_id, p.size, p.url FROM transfer_failed f"
+            " JOIN transfer_photos p ON p.transfer_id = f.transfer_id AND p.idx = f.idx"
+            " WHERE f.transfer_id = ? AND f.attempts < ? ORDER BY p.idx",
+            (transfer.id, max_attempts)
+        ).fetchall()
+        return [(idx, album, _photo(*photo)) for idx, album, *photo in rows]
+
+    @classmethod
+    def failures(cls, transfer_id: str) -> list[tuple[str, int]]:
+        """Неудачные фото по причинам: [(причина, сколько фото)], частые первыми."""
+        if cls._conn is None:
+            return []
+        return cls._conn.execute(
+            "SELECT reason, COUNT(*) FROM transfer_failed WHERE transfer_id = ?"
+            " GROUP BY reason ORDER BY COUNT(*) DESC",
+            (transfer_id,)
+        ).fetchall()
+
+
+class TransferTracker:
+    """
+    Ведет чекпоинт одной отправки: отдает фото (повторы, затем снимок, затем
+    досканирование альбомов) и по мере доставки сдвигает delivered и пишет неудачи.
+    """
+
+    def __init__(self, transfer: Transfer):
+        self.transfer = transfer
+        # Фото в конвейере -> (индекс в снимке, номер альбома)
+        self._positions: dict[tuple[int, int], tuple[int, int]] = {}
+
+    def _track(self, idx: int, album: int, photo: PhotoRecord) -> PhotoRecord:
+        self._positions[(photo.owner_id, photo.id)] = (idx, album)
+        return photo
+
+    def _pop(self, photo: PhotoRecord) -> Optional[tuple[int, int]]:
+        return self._positions.pop((photo.owner_id, photo.id), None)
+
+    def album_of(self, photo: PhotoRecord) -> Optional[AlbumState]:
+        position = self._positions.get((photo.owner_id, photo.id))
+        return self.transfer.albums[position[1]] if position else None
+
+    async def photos(self) -> AsyncIterator[PhotoRecord]:
+        transfer = self.transfer
+        for idx, album, photo in TransferStore.retry_candidates(transfer, get_settings().TRANSFER_MAX_ATTEMPTS):
+            yield self._track(idx, album, photo)
+
+        position = transfer.delivered
+        while position < transfer.scanned:
+            chunk = TransferStore.snapshot(transfer.id, position, SNAPSHOT_CHUNK)
+            if not chunk:
+                break
+            for idx, album, photo in chunk:
+                yield self._track(idx, album, photo)
+            position = chunk[-1][0] + 1
+
+        if not transfer.scan_complete:
+            async for photo in self._scan():
+                yield photo
+
+    async def _scan(self) -> AsyncIterator[PhotoRecord]:
+        """
+        Сканирует недосканированные альбомы параллельно (не больше BULK_SCAN_ALBUMS сразу,
+        запросы идут через общий лимит ВК) и сливает их в один поток. Фото, которые уже
+        встречались в другом альбоме или в снимке до рестарта, пропускаются.
+        """
+        transfer = self.transfer
+        pending = [i for i, album in enumerate(transfer.albums) if not album.scanned]
+        seen = TransferStore.snapshot_keys(transfer.id) if transfer.scanned else set()
+        semaphore = asyncio.Semaphore(get_settings().BULK_SCAN_ALBUMS)
+        # Страницы ждут отправки здесь; очередь короткая, чтобы сканирование не убегало от доставки
+        pages: asyncio.Queue[tuple[int, Optional[PhotoPage], Optional[Exception]]] = asyncio.Queue(maxsize=len(pending))
+
+        async def scan_album(index: int):
+            info = transfer.albums[index].info
+            async with semaphore:
+                try:
+                    async for page in VKService.iter_photos(info.owner_id, info.album_id):
+                        await pages.put((index, page, None))
+                except Exception as e:
+                    logger.error(f"Transfers: альбом {info.owner_id}_{info.album_id} не отсканирован: {e}")
+                    await pages.put((index, None, e))
+                    return
+            await pages.put((index, None, None))
+
+        scanners = [asyncio.create_task(scan_album(i)) for i in pending]
+        try:
+            while pending:
+                index, page, error = await pages.get()
+                album = transfer.albums[index]
+                if page is None:
+                    album.scanned = True
+                    album.error = _reason(error) if error else ''
+                    TransferStore.save_album(transfer, index)
+                    pending.remove(index)
+                    continue
+
+                if album.info.size != page.total:
+                    album.info.size = page.total
+                    TransferStore.save_album(transfer, index)
+                records = []
+                for photo in page.photos:
+                    key = (photo.owner_id, photo.id)
+                    if key not in seen:
+                        seen.add(key)
+                        records.append(VKService.with_quality(photo, transfer.quality))
+                start = transfer.scanned
+                TransferStore.append_photos(transfer, index, records)
+                album.found += len(records)
+                for i, photo in enumerate(records):
+                    yield self._track(start + i, index, photo)
+        finally:
+            for scanner in scanners:
+                scanner.cancel()
+
+    def failed(self, photo: PhotoRecord, error: BaseException):
+        position = self._pop(photo)
+        if position is not None:
+            TransferStore.fail(self.transfer.id, position[0], _reason(error))
+
+    def failed_many(self, photos: list[PhotoRecord], error: BaseException):
+        for photo in photos:
+            self.failed(photo, error)
+
+    def delivered(self, photos: list[PhotoRecord], done: int, parts: int = None):
+        """Фото ушли пользователю: сдвигаем границу и снимаем удачные повторы."""
+        transfer = self.transfer
+        positions = [p for p in map(self._pop, photos) if p is not None]
+        TransferStore.resolve(transfer.id, [idx for idx, _ in positions if idx < transfer.delivered])
+        fresh = [idx for idx, _ in positions if idx >= transfer.delivered]
+        if fresh:
+            transfer.delivered = max(fresh) + 1
+        for _, album in positions:
+            transfer.albums[album].done += 1
+        transfer.done = done
+        if parts is not None:
+            transfer.parts = parts
+        TransferStore.save(transfer)
@@ -12,6 +12,105 @@ class Settings(BaseSettings):
     VK_LIFE_ALBUM_ID: Optional[int] = None
     VK_LIFE_GROUP_ID: Optional[int] = None
 
+    # Адреса API: свой Bot API сервер или локальные заглушки (см. benchmarks)
+    VK_API_URL: str = "https://api.vk.com/method/"
+    TG_API_SERVER: str = ""
+
+    # HTTP-пул: лимиты соединений, keep-alive и HTTP/2 (нужен пакет h2)
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP2: bool = True
+    # Скачивание: предел размера файла (байт) и число попыток с докачкой
+    DOWNLOAD_MAX_BYTES: int = 50 * 1024 * 1024
+    DOWNLOAD_RETRIES: int = 4
+
+    # Конвейер /get_album: сколько фото качаем параллельно
+    # и на сколько пачек (по 10 фото) забегаем вперед отправки
+    DOWNLOAD_CONCURRENCY: int = 8
+    DOWNLOAD_PREFETCH_BATCHES: int = 2
+
+    # Сканирование альбомов: сколько страниц (по 1000 фото) в одном execute
+    # (ответ execute ограничен по размеру: 1000 фото со всеми размерами — несколько МБ JSON)
+    # и сколько execute-запросов держим параллельно (лимит ВК — 3 запроса/сек)
+    VK_EXECUTE_PAGES: int = 2
+    VK_SCAN_CONCURRENCY: int = 3
+    # Выгрузка нескольких альбомов: сколько альбомов сканируем одновременно (лимит ВК общий)
+    BULK_SCAN_ALBUMS: int = 3
+
+    # Профиль качества /get_album по умолчанию: original / telegram-optimal / preview
+    PHOTO_QUALITY: str = "telegram-optimal"
+
+    # Кэш списков альбомов: сколько секунд верим без перепроверки
+    # и сколько фото суммарно держим в памяти (запись со всеми размерами — около 2 КБ)
+    ALBUM_CACHE_TTL: int = 300
+    ALBUM_CACHE_MAX_PHOTOS: int = 20_000
+
+    # Локальные данные бота (SQLite и т.п.), в Docker — примонтированный том
+    DATA_DIR: str = "data"
+    # Сколько записей VK-фото -> Telegram file_id держим в кэше (LRU)
+    FILE_ID_CACHE_SIZE: int = 200_000
+
+    # Передача Telegram -> ВК: файлы крупнее порога (байт) пишем во временный файл,
+    # и сколько файлов скачиваем заранее, пока идет загрузка в ВК
+    SPOOL_MAX_MEMORY: int = 1024 * 1024
+    TRANSFER_PREFETCH: int = 2
+    # Сколько пачек грузим в ВК параллельно и сколько секунд живет адрес сервера загрузки
+    UPLOAD_CONCURRENCY: int = 3
+    UPLOAD_SERVER_TTL: int = 600
+
+    # Предобработка фото в пуле процессов: профиль для каждой команды
+    # (telegram / vk / compact, пусто — отправлять как есть)
+    IMAGE_WORKERS: int = 2
+    IMAGE_PROFILE_GET_ALBUM: str = "telegram"
+    IMAGE_PROFILE_ADD_LIFE: str = ""
+    IMAGE_PROFILE_WALL_POST: str = ""
+
+    # Дедупликация загрузок: индекс хэшей уже загруженных фото,
+    # перцептивный хэш (нужен Pillow) и допустимое расстояние Хэмминга
+    DEDUP_ENABLED: bool = True
+    DEDUP_PHASH: bool = True
+    DEDUP_PHASH_DISTANCE: int = 4
+
+    # /get_album zip: максимальный размер тома (Bot API принимает документы до 50 МБ)
+    ARCHIVE_MAX_BYTES: int = 49 * 1024 * 1024
+
+    # Лимиты запросов (в секунду). Скорость адаптивно снижается при флуд-ошибках
+    VK_RATE: float = 3.0
+    VK_WRITE_RATE: float = 1.0
+    VK_FLOOD_PAUSE: float = 5.0
+    TG_GLOBAL_RATE: float = 30.0
+    TG_CHAT_RATE: float = 1.0
+    TG_CHAT_BURST: int = 3
+
+    # Фоновые задачи: воркеры, лимит задач на пользователя,
+    # как часто (сек) обновлять статусное сообщение
+    JOB_WORKERS: int = 4
+    JOB_MAX_PER_USER: int = 3
+    JOB_PROGRESS_INTERVAL: float = 3.0
+    # Отправка альбома пишет чекпоинт в DATA_DIR и после рестарта продолжается с него;
+    # не ушедшее фото перезапускаем не больше стольких раз
+    TRANSFER_MAX_ATTEMPTS: int = 3
+
+    # Прием апдейтов: polling (один процесс) или webhook (aiohttp, WEB_WORKERS процессов на одном порту).
+    # WEBHOOK_URL — внешний адрес бота; если пуст, вебхук считается уже установленным
+    BOT_MODE: str = "polling"
+    WEBHOOK_URL: str = ""
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: Optional[SecretStr] = None
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8080
+    WEB_WORKERS: int = 1
+    # Где хранятся состояния FSM и части медиагрупп: memory — в процессе,
+    # sqlite — общая база в DATA_DIR для всех воркеров и реплик на одной машине
+    STATE_STORAGE: str = "memory"
+
+    # Метрики в формате Prometheus (GET /metrics) и профилирование по запросу
+    # (POST /debug/profile). Слушаем только локально, наружу не выставляем
+    METRICS_ENABLED: bool = True
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9108
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
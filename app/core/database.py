@@ -0,0 +1,36 @@
+import asyncio
+import sqlite3
+from pathlib import Path
+from typing import Callable, TypeVar
+
+from app.core.config import get_settings
+
+# Все базы в DATA_DIR могут делить несколько воркеров, а запросы идут прямо из event loop:
+# занятую базу ждем недолго (блокируя loop), а в async-коде дальше повторяем через asyncio.sleep
+BUSY_TIMEOUT = 0.05
+BUSY_RETRIES = 40
+
+T = TypeVar("T")
+
+
+def open_db(filename: str, *schema: str) -> sqlite3.Connection:
+    """Открывает базу DATA_DIR/filename в режиме WAL и создает таблицы (CREATE ... IF NOT EXISTS)."""
+    path = Path(get_settings().DATA_DIR) / filename
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    for statement in schema:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+async def retry_busy(func: Callable[[], T]) -> T:
+    """Выполняет запрос; если база занята другим воркером — повторяет, не блокируя loop."""
+    for attempt in range(BUSY_RETRIES):
+        try:
+            return func()
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or attempt == BUSY_RETRIES - 1:
+                raise
+            await asyncio.sleep(BUSY_TIMEOUT)
@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import sqlite3
+from typing import AsyncIterator, BinaryIO, Optional
+
+from aiogram import Bot, types
+from loguru import logger
+
+from app.core.config import get_settings
+from app.core.database import open_db
+from app.core.http_client import download_file
+from app.core.image_processing import ImageProcessor
+from app.core.transfer import iter_telegram_photos
+from app.core.vk_service import VKService
+
+# Области индекса: альбом Life is Life и фото, загруженные для постов на стене
+LIFE_SCOPE = "life"
+WALL_SCOPE = "wall"
+
+
+def _sha256(f: BinaryIO) -> str:
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(64 * 1024), b""):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+class DedupIndex:
+    """
+    Индекс уже загруженных в ВК фото (Singleton на SQLite).
+    Хранит для каждого фото ВК (owner_id_id) хэши трех видов:
+    tg — file_unique_id Telegram (повторная пересылка, даже не качаем),
+    sha256 — точная копия файла, phash — перцептивный dHash (пережатые копии).
+    """
+    _conn: sqlite3.Connection = None
+    _seed_task: asyncio.Task = None
+
+    @classmethod
+    def open(cls):
+        if cls._conn is not None:
+            return
+        cls._conn = open_db(
+            "dedup_index.sqlite3",
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " scope TEXT NOT NULL, kind TEXT NOT NULL, hash TEXT NOT NULL, photo TEXT NOT NULL,"
+            " PRIMARY KEY (scope, kind, hash))",
+            "CREATE INDEX IF NOT EXISTS hashes_photo ON hashes (scope, photo)"
+        )
+        logger.info("DedupIndex: Открыт.")
+
+    @classmethod
+    def close(cls):
+        if cls._seed_task:
+            cls._seed_task.cancel()
+            cls._seed_task = None
+        if cls._conn:
+            cls._conn.close()
+            cls._conn = None
+            logger.info("DedupIndex: Закрыт.")
+
+    @classmethod
+    def find(cls, scope: str, kind: str, value: str) -> Optional[str]:
+        if cls._conn is None:
+            return None
+        row = cls._conn.execute(
+            "SELECT photo FROM hashes WHERE scope = ? AND kind = ? AND hash = ?", (scope, kind, value)
+        ).fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def find_similar(cls, scope: str, phash: int) -> Optional[str]:
+        """Ищет фото с dHash на расстоянии Хэмминга не больше DEDUP_PHASH_DISTANCE."""
+        if cls._conn is None:
+            return None
+        distance = get_settings().DEDUP_PHASH_DISTANCE
+        rows = cls._conn.execute("SELECT hash, photo FROM hashes WHERE scope = ? AND kind = 'phash'", (scope,))
+        for value, photo in rows:
+            if (int(value, 16) ^ phash).bit_count() <= distance:
+                return photo
+        return None
+
+    @classmethod
+    def add(cls, scope: str, photo: str, hashes: dict[str, str]):
+        if cls._conn is None:
+            return
+        with cls._conn:
+            cls._conn.executemany(
+                "INSERT OR REPLACE INTO hashes (scope, kind, hash, photo) VALUES (?, ?, ?, ?)",
+                [(scope, kind, value, photo) for kind, value in hashes.items() if value]
+            )
+
+    @classmethod
+    def known_photos(cls, scope: str) -> set[str]:
+        if cls._conn is None:
+            return set()
+        return {row[0] for row in cls._conn.execute("SELECT DISTINCT photo FROM hashes WHERE scope = ?", (scope,))}
+
+    @classmethod
+    def forget_photos(cls, scope: str, photos: set[str]):
+        if cls._conn is None or not photos:
+            return
+        with cls._conn:
+            cls._conn.executemany("DELETE FROM hashes WHERE scope = ? AND photo = ?", [(scope, p) for p in photos])
+
+    # --- ЗАПОЛНЕНИЕ ИЗ АЛЬБОМА ---
+    @classmethod
+    def start_seeding(cls):
+        """Фоном проходит альбом Life is Life и добавляет в индекс dHash новых фото."""
+        settings = get_settings()
+        if not settings.DEDUP_ENABLED or not settings.VK_LIFE_ALBUM_ID or cls._conn is None:
+            return
+        # Фото из ВК пережаты, совпасть с присланными они могут только по dHash
+        if not settings.DEDUP_PHASH or not ImageProcessor.is_running():
+            return
+        if cls._seed_task is None or cls._seed_task.done():
+            cls._seed_task = asyncio.create_task(cls._seed_life_album())
+
+    @classmethod
+    async def _seed_life_album(cls):
+        settings = get_settings()
+        owner_id = -settings.VK_LIFE_GROUP_ID if settings.VK_LIFE_GROUP_ID else VKService.get_user_id()
+        if owner_id is None:
+            logger.warning("DedupIndex: не удалось определить владельца альбома, индекс не заполняется.")
+            return
+
+        known = cls.known_photos(LIFE_SCOPE)
+        seen = set()
+        added = 0
+        semaphore = asyncio.Semaphore(settings.DOWNLOAD_CONCURRENCY)
+
+        async def index_photo(photo):
+            nonlocal added
+            async with semaphore:
+                # Для dHash хватает превью: хэш почти не зависит от размера
+                data = await download_file(VKService.with_quality(photo, "preview").url)
+            phash = await ImageProcessor.phash(data)
+            if phash is not None:
+                cls.add(LIFE_SCOPE, f"{photo.owner_id}_{photo.id}", {"phash": f"{phash:016x}"})
+                added += 1
+
+        try:
+            async for page in VKService.iter_photos(owner_id, str(settings.VK_LIFE_ALBUM_ID)):
+                new = []
+                for photo in page.photos:
+                    key = f"{photo.owner_id}_{photo.id}"
+                    seen.add(key)
+                    if key not in known:
+                        new.append(photo)
+                results = await asyncio.gather(*(index_photo(p) for p in new), return_exceptions=True)
+                for result in results:
+                    if isinstance(result, Exception):
+                        logger.debug(f"DedupIndex: фото пропущено при заполнении: {result}")
+        except Exception as e:
+            logger.error(f"DedupIndex: ошибка сканирования альбома: {e}")
+            return
+
+        # Удаленные из альбома фото больше не считаются дублями
+        cls.forget_photos(LIFE_SCOPE, known - seen)
+        logger.info(f"DedupIndex: альбом просканирован, добавлено {added}, удалено {len(known - seen)}.")
+
+
+class DedupFilter:
+    """
+    Этап между скачиванием из Telegram и загрузкой в ВК: дубли отсеиваются
+    до того, как байты уйдут в ВК. Уже известные по file_unique_id фото
+    не скачиваются вовсе. После загрузки commit() дописывает хэши новых фото.
+    similar=False — только точные совпадения (tg/sha256), без dHash.
+    """
+
+    def __init__(self, scope: str, similar: bool = True):
+        self.scope = scope
+        self.enabled = get_settings().DEDUP_ENABLED
+        self.similar = similar and get_settings().DEDUP_PHASH
+        # Индекс сообщения -> фото ВК, которое уже есть
+        self.duplicates: dict[int, str] = {}
+        self._passed: list[dict[str, str]] = []
+
+    @property
+    def skipped(self) -> int:
+        return len(self.duplicates)
+
+    async def _find_duplicate(self, f: BinaryIO, hashes: dict[str, str]) -> Optional[str]:
+        hashes["sha256"] = _sha256(f)
+        photo = DedupIndex.find(self.scope, "sha256", hashes["sha256"])
+        if photo or not self.similar:
+            return photo
+
+        phash = await ImageProcessor.phash(f.read())
+        f.seek(0)
+        if phash is None:
+            return None
+        hashes["phash"] = f"{phash:016x}"
+        return DedupIndex.find_similar(self.scope, phash)
+
+    async def iter_new_photos(self, bot: Bot, messages: list[types.Message], profile: str = "") -> AsyncIterator[BinaryIO]:
+        """Отдает файлы только тех фото, которых еще нет в индексе; порядок сохраняется."""
+        if not self.enabled:
+            async for f in iter_telegram_photos(bot, messages, profile):
+                yield f
+            return
+
+        to_download = []
+        for index, msg in enumerate(messages):
+            photo = DedupIndex.find(self.scope, "tg", msg.photo[-1].file_unique_id)
+            if photo:
+                self.duplicates[index] = photo
+            else:
+                to_download.append(index)
+
+        files = iter_telegram_photos(bot, [messages[i] for i in to_download], profile)
+        try:
+            for index in to_download:
+                f = await anext(files)
+                hashes = {"tg": messages[index].photo[-1].file_unique_id}
+                photo = await self._find_duplicate(f, hashes)
+                if photo:
+                    self.duplicates[index] = photo
+                    # Запомним и этот file_unique_id, чтобы в следующий раз не качать
+                    DedupIndex.add(self.scope, photo, {"tg": hashes["tg"]})
+                    f.close()
+                    continue
+                self._passed.append(hashes)
+                yield f
+        finally:
+            await files.aclose()
+
+    def commit(self, uploaded: list[dict]):
+        """Записывает хэши загруженных фото; uploaded — ответ ВК в том же порядке."""
+        if not self.enabled:
+            return
+        for hashes, photo in zip(self._passed, uploaded):
+            DedupIndex.add(self.scope, f"{photo['owner_id']}_{photo['id']}", hashes)
+
+    def forget_duplicates(self):
+        """Убирает из индекса найденные дубли (фото удалено в ВК) — при повторе они загрузятся заново."""
+        DedupIndex.forget_photos(self.scope, set(self.duplicates.values()))
+        self.duplicates.clear()
+
+    def merge_attachments(self, uploaded: list[dict], total: int) -> list[str]:
+        """Фото для поста в исходном порядке: дубли — уже загруженными, остальные — новыми."""
+        new = iter(uploaded)
+        result = []
+        for index in range(total):
+            if index in self.duplicates:
+                result.append(self.duplicates[index])
+            else:
+                photo = next(new)
+                result.append(f"{photo['owner_id']}_{photo['id']}")
+        return result
@@ -0,0 +1,89 @@
+import sqlite3
+import time
+from typing import Optional
+
+from loguru import logger
+
+from app.core.config import get_settings
+from app.core.database import open_db
+
+
+class FileIdCache:
+    """
+    Постоянный кэш VK-фото -> Telegram file_id (Singleton на SQLite).
+    Повторная отправка уже известного фото идет по file_id:
+    без скачивания из ВК и без повторной загрузки в Telegram.
+    Размер ограничен FILE_ID_CACHE_SIZE, вытесняются давно не использованные записи.
+    """
+    _conn: sqlite3.Connection = None
+    _max_size: int = 0
+    # Ключи, прочитанные из кэша: last_used обновляем пачкой в put_many, а не на каждое фото
+    _touched: set[str] = set()
+
+    @classmethod
+    def open(cls):
+        if cls._conn is not None:
+            return
+        cls._max_size = get_settings().FILE_ID_CACHE_SIZE
+        cls._conn = open_db(
+            "file_id_cache.sqlite3",
+            "CREATE TABLE IF NOT EXISTS file_ids ("
+            " key TEXT PRIMARY KEY, file_id TEXT NOT NULL, last_used REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS file_ids_last_used ON file_ids (last_used)"
+        )
+        logger.info("FileIdCache: Открыт.")
+
+    @classmethod
+    def close(cls):
+        if cls._conn:
+            cls.put_many({})
+            cls._conn.close()
+            cls._conn = None
+            logger.info("FileIdCache: Закрыт.")
+
+    @classmethod
+    def get(cls, key: str) -> Optional[str]:
+        if cls._conn is None:
+            return None
+        row = cls._conn.execute("SELECT file_id FROM file_ids WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        cls._touched.add(key)
+        return row[0]
+
+    @classmethod
+    def put_many(cls, items: dict[str, str]):
+        """Сохраняет новые file_id и заодно отмечает использованные с прошлого раза (одна транзакция)."""
+        if cls._conn is None or not (items or cls._touched):
+            return
+        now = time.time()
+        touched = cls._touched - items.keys()
+        cls._touched = set()
+        with cls._conn:
+            cls._conn.executemany("UPDATE file_ids SET last_used = ? WHERE key = ?", [(now, key) for key in touched])
+            if items:
+                cls._conn.executemany(
+                    "INSERT OR REPLACE INTO file_ids (key, file_id, last_used) VALUES (?, ?, ?)",
+                    [(key, file_id, now) for key, file_id in items.items()]
+                )
+                cls._evict()
+
+    @classmethod
+    def delete_many(cls, keys: list[str]):
+        if cls._conn is None or not keys:
+            return
+        cls._touched.difference_update(keys)
+        with cls._conn:
+            cls._conn.executemany("DELETE FROM file_ids WHERE key = ?", [(key,) for key in keys])
+
+    @classmethod
+    def _evict(cls):
+        (size,) = cls._conn.execute("SELECT COUNT(*) FROM file_ids").fetchone()
+        excess = size - cls._max_size
+        if excess > 0:
+            cls._conn.execute(
+                "DELETE FROM file_ids WHERE key IN "
+                "(SELECT key FROM file_ids ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+            logger.debug(f"FileIdCache: вытеснено {excess} записей.")
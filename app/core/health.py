@@ -0,0 +1,77 @@
+import asyncio
+import time
+from typing import Awaitable
+
+from aiohttp import web
+from loguru import logger
+
+from app.core.metrics import Gauge
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+SUBSYSTEM_READY = Gauge("vkbot_subsystem_ready", "Подсистема прогрета (1) или нет (0)", ("subsystem",))
+
+
+class Health:
+    """
+    Готовность подсистем (Singleton). Бот принимает апдейты сразу после старта,
+    а VK, пулы и прочее прогреваются фоном — здесь видно, что уже готово.
+    GET /health — процесс жив, GET /ready — 200, только когда все подсистемы готовы.
+    """
+    _status: dict[str, str] = {}
+    _errors: dict[str, str] = {}
+    _started = time.monotonic()
+
+    @classmethod
+    def set(cls, name: str, status: str, error: str = None):
+        cls._status[name] = status
+        if error:
+            cls._errors[name] = error
+        else:
+            cls._errors.pop(name, None)
+        SUBSYSTEM_READY.set(int(status == READY), subsystem=name)
+
+    @classmethod
+    async def track(cls, name: str, warmup: Awaitable):
+        """Выполняет прогрев подсистемы и отмечает результат. Ошибка не роняет остальной прогрев."""
+        cls.set(name, STARTING)
+        started = time.monotonic()
+        try:
+            await warmup
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            cls.set(name, FAILED, repr(e))
+            logger.error(f"Health: {name} не поднялся: {e}")
+            return
+        cls.set(name, READY)
+        logger.info(f"Health: {name} готов за {time.monotonic() - started:.2f} c")
+
+    @classmethod
+    def is_ready(cls) -> bool:
+        return bool(cls._status) and all(s == READY for s in cls._status.values())
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        return {
+            "ready": cls.is_ready(),
+            "uptime": round(time.monotonic() - cls._started, 3),
+            "subsystems": dict(cls._status),
+            "errors": dict(cls._errors),
+        }
+
+    # --- HTTP ---
+    @classmethod
+    async def _handle_health(cls, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    @classmethod
+    async def _handle_ready(cls, request: web.Request) -> web.Response:
+        return web.json_response(cls.snapshot(), status=200 if cls.is_ready() else 503)
+
+    @classmethod
+    def register(cls, app: web.Application):
+        app.router.add_get("/health", cls._handle_health)
+        app.router.add_get("/ready", cls._handle_ready)
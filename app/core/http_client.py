@@ -1,6 +1,21 @@
+import asyncio
+import random
+import time
+from typing import AsyncIterator
+
 import httpx
 from loguru import logger
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
+
+from app.core.config import get_settings
+from app.core.metrics import RETRIES, STAGE_SECONDS
+
+# Размер куска при потоковом скачивании
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadTooLargeError(Exception):
+    """Файл больше допустимого DOWNLOAD_MAX_BYTES."""
+
 
 class HTTPClient:
     """
@@ -13,7 +28,20 @@ class HTTPClient:
     def get_client(cls) -> httpx.AsyncClient:
         """Получить текущий экземпляр клиента или создать новый."""
         if cls._client is None:
-            cls._client = httpx.AsyncClient(timeout=30.0)
+            settings = get_settings()
+            limits = httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            )
+            http2 = settings.HTTP2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    logger.warning("HTTPClient: пакет h2 не установлен, работаем по HTTP/1.1.")
+                    http2 = False
+            cls._client = httpx.AsyncClient(timeout=30.0, limits=limits, http2=http2)
             logger.debug("HTTPClient: Создана новая сессия.")
         return cls._client
 
@@ -25,18 +53,73 @@ class HTTPClient:
             cls._client = None # noqa
             logger.info("HTTPClient: Сессия закрыта.")
 
-@retry(
-    stop=stop_after_attempt(3),      # Повторять 3 раза
-    wait=wait_fixed(2),              # Ждать 2 секунды
-    retry=retry_if_exception_type((httpx.RequestError, httpx.TimeoutException)),
-    reraise=True
-)
-async def download_file(url: str) -> bytes:
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.RequestError)
+
+
+def _backoff(attempt: int) -> float:
+    """Экспоненциальная пауза с разбросом, чтобы повторы не шли залпом."""
+    return min(8.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+async def iter_download(url: str, max_bytes: int = None) -> AsyncIterator[bytes]:
     """
-    Скачивает файл по URL.
-    При сбое сети автоматически делает повторные попытки.
+    Потоково скачивает файл по URL кусками.
+    При обрыве посреди передачи докачивает с места остановки через Range
+    (если сервер Range не поддержал — пропускает уже отданные байты),
+    повторы — с экспоненциальной паузой. Больше max_bytes не отдает.
     """
+    settings = get_settings()
+    if max_bytes is None:
+        max_bytes = settings.DOWNLOAD_MAX_BYTES
     client = HTTPClient.get_client()
-    response = await client.get(url)
-    response.raise_for_status()
-    return response.content
\ No newline at end of file
+    received = 0
+    attempt = 0
+
+    while True:
+        headers = {"Range": f"bytes={received}-"} if received else None
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                response.raise_for_status()
+                resumed = response.status_code == 206
+                length = response.headers.get("content-length")
+                if length and (received if resumed else 0) + int(length) > max_bytes:
+                    raise DownloadTooLargeError(f"{url}: больше {max_bytes} байт")
+
+                # Сервер проигнорировал Range и отдает файл сначала
+                skip = 0 if resumed else received
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    if skip:
+                        if len(chunk) <= skip:
+                            skip -= len(chunk)
+                            continue
+                        chunk = chunk[skip:]
+                        skip = 0
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise DownloadTooLargeError(f"{url}: больше {max_bytes} байт")
+                    yield chunk
+            return
+        except (httpx.RequestError, httpx.HTTPStatusError) as e:
+            attempt += 1
+            if not _is_retryable(e) or attempt >= settings.DOWNLOAD_RETRIES:
+                raise
+            RETRIES.inc(kind="download")
+            logger.debug(f"Download: {url} оборвался на {received} байт ({e!r}), повтор #{attempt}")
+            await asyncio.sleep(_backoff(attempt))
+
+
+async def download_file(url: str, max_bytes: int = None) -> bytes:
+    """
+    Скачивает файл по URL целиком.
+    При сбое сети автоматически докачивает и делает повторные попытки.
+    """
+    data = bytearray()
+    started = time.perf_counter()
+    async for chunk in iter_download(url, max_bytes):
+        data += chunk
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="download")
+    return bytes(data)
@@ -0,0 +1,215 @@
+import asyncio
+import importlib.util
+import io
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from loguru import logger
+
+from app.core.config import get_settings
+from app.core.metrics import IMAGE_POOL_INFLIGHT, STAGE_SECONDS
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+# Pillow и пул процессов импортируются лениво: это ускоряет старт бота.
+# Предобработка необязательна: без Pillow фото идут как есть
+HAS_PILLOW = importlib.util.find_spec("PIL") is not None
+
+
+@dataclass(frozen=True)
+class ImageProfile:
+    max_side: int            # Максимальная сторона в пикселях
+    quality: int             # Качество JPEG при перекодировании
+    max_bytes: Optional[int] = None  # Предел размера файла
+    max_ratio: Optional[float] = None  # Предел соотношения сторон (длинная к короткой)
+    max_sides_sum: Optional[int] = None  # Предел суммы ширины и высоты
+
+
+# Профили предобработки; для команды выбираются через IMAGE_PROFILE_* в .env
+PROFILES = {
+    # Лимиты Bot API для фото: до 10 МБ, сумма сторон до 10000, стороны не больше чем 20:1.
+    # Оригиналы ВК (до 2560px) в размер укладываются всегда, а вот панорамы Telegram отклоняет
+    "telegram": ImageProfile(
+        max_side=2560, quality=87, max_bytes=10 * 1024 * 1024, max_ratio=20, max_sides_sum=10000
+    ),
+    # Самый крупный размер, который ВК показывает в альбоме
+    "vk": ImageProfile(max_side=2560, quality=90),
+    "compact": ImageProfile(max_side=1280, quality=82, max_bytes=1024 * 1024),
+}
+
+
+def _fits(profile: ImageProfile, width: int, height: int, image_format: str, size: int) -> bool:
+    """Фото уже укладывается в профиль и перекодировать его не нужно."""
+    return (
+        image_format == "JPEG"
+        and max(width, height) <= profile.max_side
+        and (profile.max_bytes is None or size <= profile.max_bytes)
+        and (profile.max_ratio is None or max(width, height) <= profile.max_ratio * max(min(width, height), 1))
+        and (profile.max_sides_sum is None or width + height <= profile.max_sides_sum)
+    )
+
+
+def _pad_to_ratio(img, max_ratio: float):
+    """Дополняет слишком вытянутое фото белыми полями до max_ratio: обрезка потеряла бы часть панорамы."""
+    from PIL import Image
+
+    width, height = img.size
+    if max(width, height) <= max_ratio * min(width, height):
+        return img
+    if width > height:
+        canvas = Image.new("RGB", (width, -(-width // int(max_ratio))), "white")
+    else:
+        canvas = Image.new("RGB", (-(-height // int(max_ratio)), height), "white")
+    canvas.paste(img, ((canvas.width - width) // 2, (canvas.height - height) // 2))
+    return canvas
+
+
+def _process_sync(data: bytes, profile: ImageProfile) -> bytes:
+    """
+    Выполняется в отдельном процессе. Фото, которое уже укладывается в профиль,
+    возвращается без изменений — лишнего перекодирования не делаем.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        if _fits(profile, *img.size, img.format, len(data)):
+            return data
+
+        img = img.convert("RGB")
+        if profile.max_ratio:
+            img = _pad_to_ratio(img, profile.max_ratio)
+        img.thumbnail((profile.max_side, profile.max_side))
+        if profile.max_sides_sum and sum(img.size) > profile.max_sides_sum:
+            scale = profile.max_sides_sum / sum(img.size)
+            img = img.resize((int(img.width * scale), int(img.height * scale)), Image.Resampling.LANCZOS)
+
+        quality = profile.quality
+        while True:
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=quality, optimize=True)
+            if profile.max_bytes is None or out.tell() <= profile.max_bytes or quality <= 40:
+                return out.getvalue()
+            quality -= 10
+
+
+def _header_fits(data: bytes, profile: ImageProfile) -> bool:
+    """
+    Проверка по заголовку прямо в event loop: Image.open читает только заголовок,
+    без декодирования. В пул уходят лишь фото, которые нарушают профиль.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return _fits(profile, *img.size, img.format, len(data))
+    except Exception:
+        # Нечитаемый заголовок — пусть разбирается пул (и вернет исходные байты при ошибке)
+        return False
+
+
+def _dhash_sync(data: bytes) -> int:
+    """Перцептивный dHash (64 бита): устойчив к пережатию и смене размера."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        small = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = value << 1 | (left > right)
+    return value
+
+
+def _process_noop() -> None:
+    """Прогрев процесса пула: заодно импортирует Pillow."""
+    import PIL.Image  # noqa: F401
+
+
+class ImageProcessor:
+    """
+    Предобработка фото (уменьшение/пережатие) в пуле процессов (Singleton),
+    чтобы декодирование JPEG не блокировало event loop.
+    """
+    _executor: "ProcessPoolExecutor" = None
+
+    @classmethod
+    def start(cls):
+        if cls._executor is not None:
+            return
+        if not HAS_PILLOW:
+            logger.warning("ImageProcessor: Pillow не установлен, предобработка отключена.")
+            return
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = get_settings().IMAGE_WORKERS
+        cls._executor = ProcessPoolExecutor(max_workers=workers)
+        logger.info(f"ImageProcessor: Пул из {workers} процессов запущен.")
+
+    @classmethod
+    async def warm_up(cls):
+        """Поднимает процессы пула заранее, чтобы первое фото не ждало их запуска."""
+        if cls._executor is None:
+            return
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(cls._executor, _process_noop) for _ in range(get_settings().IMAGE_WORKERS)
+        ))
+
+    @classmethod
+    def stop(cls):
+        if cls._executor:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
+            logger.info("ImageProcessor: Пул остановлен.")
+
+    @classmethod
+    def is_running(cls) -> bool:
+        return cls._executor is not None
+
+    @staticmethod
+    def get_profile(name: str) -> Optional[ImageProfile]:
+        if not name:
+            return None
+        profile = PROFILES.get(name)
+        if profile is None:
+            logger.warning(f"ImageProcessor: неизвестный профиль '{name}', пропускаем предобработку")
+        return profile
+
+    @classmethod
+    async def process(cls, data: bytes, profile_name: str) -> bytes:
+        """
+        Приводит фото к профилю. Без пула, без профиля, при ошибке или если фото
+        уже укладывается в профиль, отдает исходные байты.
+        """
+        profile = cls.get_profile(profile_name)
+        if cls._executor is None or profile is None or _header_fits(data, profile):
+            return data
+        IMAGE_POOL_INFLIGHT.inc()
+        try:
+            async with STAGE_SECONDS.time(stage="image_process"):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(cls._executor, _process_sync, data, profile)
+        except Exception as e:
+            logger.warning(f"ImageProcessor: не удалось обработать фото ({e}), отправляем как есть")
+            return data
+        finally:
+            IMAGE_POOL_INFLIGHT.dec()
+
+    @classmethod
+    async def phash(cls, data: bytes) -> Optional[int]:
+        """Перцептивный хэш фото; None, если пул не запущен или фото не читается."""
+        if cls._executor is None:
+            return None
+        IMAGE_POOL_INFLIGHT.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(cls._executor, _dhash_sync, data)
+        except Exception as e:
+            logger.warning(f"ImageProcessor: не удалось посчитать хэш ({e})")
+            return None
+        finally:
+            IMAGE_POOL_INFLIGHT.dec()
@@ -0,0 +1,305 @@
+import asyncio
+import itertools
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from aiogram import types
+from loguru import logger
+
+from app.core.config import get_settings
+from app.core.metrics import STAGE_SECONDS, Gauge, Profiler, profiling_requested
+from app.core.rate_limiter import RateLimiter
+from app.core.shared_state import JOB_BOARD_INTERVAL, JobBoard, create_job_board
+
+
+class JobLimitError(Exception):
+    """У пользователя уже слишком много задач в очереди."""
+
+
+class ProgressMessage:
+    """
+    Одно статусное сообщение задачи, которое редактируется на месте.
+    Промежуточные обновления не чаще JOB_PROGRESS_INTERVAL, финальное — всегда.
+    """
+
+    def __init__(self, message: types.Message):
+        self.message = message
+        self._text = message.text
+        self._last_edit = 0.0
+
+    async def update(self, text: str, force: bool = False):
+        interval = get_settings().JOB_PROGRESS_INTERVAL
+        if text == self._text or (not force and time.monotonic() - self._last_edit < interval):
+            return
+        self._text = text
+        self._last_edit = time.monotonic()
+        try:
+            await RateLimiter.telegram(self.message.chat.id, lambda: self.message.edit_text(text))
+        except Exception as e:
+            logger.debug(f"Jobs: не удалось обновить прогресс: {e}")
+
+    async def finish(self, text: str):
+        await self.update(text, force=True)
+
+
+@dataclass
+class Job:
+    id: int
+    user_id: int
+    title: str
+    func: Callable[["Job"], Awaitable[None]]
+    progress: ProgressMessage
+    # Вид задачи для метрик (title содержит имя альбома и в метку не годится)
+    kind: str = "job"
+    # Сколько единиц работы всего и сколько уже сделано (например, фото альбома)
+    total: int = 0
+    done: int = 0
+    cancelled: bool = False
+    # Когда поставлена: /cancel из другого воркера отменяет только более ранние задачи
+    created: float = field(default_factory=time.time)
+    # Задача порождена запросом, для которого включено профилирование
+    profile: bool = False
+    # Вызывается, когда задачу отменил пользователь (а не остановка бота)
+    on_cancel: Optional[Callable[[], None]] = field(default=None, repr=False)
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+
+class JobManager:
+    """
+    Фоновые задачи (Singleton): пул воркеров с честной очередью по пользователям.
+    Пользователи обслуживаются по кругу, и у каждого одновременно выполняется
+    не больше одной задачи — несколько огромных альбомов не займут всех воркеров.
+    Очередь у каждого процесса своя; при общем состоянии (STATE_STORAGE=sqlite)
+    /cancel доходит до задач в других процессах через JobBoard.
+    """
+    _queues: dict[int, deque[Job]] = {}
+    _ready: deque[int] = deque()
+    _running: dict[int, Job] = {}
+    _workers: list[asyncio.Task] = []
+    _cond: asyncio.Condition = None
+    _ids = itertools.count(1)
+    _board: Optional[JobBoard] = None
+    _board_task: asyncio.Task = None
+
+    @classmethod
+    def start(cls):
+        if cls._workers:
+            return
+        settings = get_settings()
+        cls._cond = asyncio.Condition()
+        cls._workers = [asyncio.create_task(cls._worker(i)) for i in range(settings.JOB_WORKERS)]
+        cls._board = create_job_board(str(os.getpid()))
+        if cls._board:
+            cls._board_task = asyncio.create_task(cls._watch_board())
+        logger.info(f"JobManager: Запущено воркеров: {settings.JOB_WORKERS}.")
+
+    @classmethod
+    async def stop(cls):
+        if cls._board_task:
+            cls._board_task.cancel()
+            await asyncio.gather(cls._board_task, return_exceptions=True)
+            cls._board_task = None
+        # Сначала дожидаемся отмены задач: воркеры, отмененные посреди завершения задачи,
+        # могут оставить Condition захваченным, и остановка зависнет
+        tasks = [job.task for job in cls._running.values() if job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for worker in cls._workers:
+            worker.cancel()
+        await asyncio.gather(*cls._workers, return_exceptions=True)
+        cls._workers = []
+        if cls._board:
+            await cls._board.leave()
+            cls._board = None
+        logger.info("JobManager: Остановлен.")
+
+    @classmethod
+    def queued_count(cls) -> int:
+        return sum(len(q) for q in cls._queues.values())
+
+    @classmethod
+    def running_count(cls) -> int:
+        return len(cls._running)
+
+    @classmethod
+    async def submit(cls, message: types.Message, title: str, func: Callable[[Job], Awaitable[None]],
+                     on_cancel: Callable[[], None] = None, kind: str = "job", limited: bool = True) -> Job:
+        """
+        Ставит задачу в очередь; статусное сообщение отправляется сразу.
+        limited=False — без лимита JOB_MAX_PER_USER (продолжение задач после рестарта).
+        """
+        user_id = message.from_user.id
+        if limited:
+            cls._check_limit(user_id)
+
+        position = cls.queued_count() + 1
+        status = await message.answer(f"🕓 {title}: в очереди (позиция {position})...")
+        job = Job(
+            id=next(cls._ids), user_id=user_id, title=title, func=func,
+            progress=ProgressMessage(status), kind=kind, profile=profiling_requested.get(), on_cancel=on_cancel
+        )
+
+        async with cls._cond:
+            # Пока отправлялся статус, могла встать другая задача этого пользователя:
+            # очередь берем заново и лимит проверяем еще раз
+            try:
+                if limited:
+                    cls._check_limit(user_id)
+            except JobLimitError:
+                await job.progress.finish(f"⏳ {title}: у вас уже много задач в очереди.")
+                raise
+            queue = cls._queues.get(user_id)
+            if queue is None:
+                queue = cls._queues[user_id] = deque()
+                cls._ready.append(user_id)
+            queue.append(job)
+            cls._cond.notify()
+        logger.info(f"JobManager: задача #{job.id} ({title}) от {user_id} в очереди.")
+        return job
+
+    @classmethod
+    def _check_limit(cls, user_id: int):
+        pending = len(cls._queues.get(user_id, ())) + (user_id in cls._running)
+        if pending >= get_settings().JOB_MAX_PER_USER:
+            raise JobLimitError(f"User {user_id} has {pending} jobs")
+
+    @classmethod
+    async def cancel(cls, user_id: int) -> int:
+        """
+        Отменяет все задачи пользователя: и выполняющуюся, и ждущие в очереди.
+        Возвращает число отмененных здесь и найденных у других процессов.
+        """
+        requested = time.time()
+        cancelled = await cls._cancel_local(user_id, requested)
+        if cls._board:
+            try:
+                cancelled += await cls._board.request_cancel(user_id, requested)
+            except Exception as e:
+                logger.error(f"JobManager: не удалось передать отмену другим воркерам: {e}")
+        return cancelled
+
+    @classmethod
+    async def _cancel_local(cls, user_id: int, before: float) -> int:
+        """Отменяет задачи пользователя в этом процессе, поставленные не позже before."""
+        cancelled = 0
+        queue = cls._queues.get(user_id, ())
+        queued = [job for job in queue if job.created <= before]
+        if queued:
+            remaining = [job for job in queue if job.created > before]
+            queue.clear()
+            queue.extend(remaining)
+            # Убираем пользователя и из круга: иначе после новой задачи он попадет в _ready дважды
+            # и будет получать два хода за круг
+            if not queue:
+                del cls._queues[user_id]
+                cls._ready.remove(user_id)
+        for job in queued:
+            job.cancelled = True
+            cancelled += 1
+            cls._cancelled(job)
+            await job.progress.finish(f"❌ {job.title}: отменено.")
+
+        job = cls._running.get(user_id)
+        if job is not None and not job.cancelled and job.created <= before:
+            job.cancelled = True
+            job.task.cancel()
+            cancelled += 1
+        return cancelled
+
+    @classmethod
+    async def _watch_board(cls):
+        """Публикует на доске свои задачи и применяет отмены, пришедшие в другие воркеры."""
+        while True:
+            await asyncio.sleep(JOB_BOARD_INTERVAL)
+            jobs = {user_id: len(queue) for user_id, queue in cls._queues.items() if queue}
+            for user_id in cls._running:
+                jobs[user_id] = jobs.get(user_id, 0) + 1
+            try:
+                requests = await cls._board.sync(jobs)
+            except Exception as e:
+                logger.error(f"JobManager: доска задач недоступна: {e}")
+                continue
+            for user_id, requested in requests.items():
+                if user_id in jobs:
+                    await cls._cancel_local(user_id, requested)
+
+    @staticmethod
+    def _cancelled(job: Job):
+        if job.on_cancel:
+            try:
+                job.on_cancel()
+            except Exception as e:
+                logger.error(f"JobManager: обработчик отмены задачи #{job.id} упал: {e}")
+
+    @classmethod
+    def _pick(cls) -> Optional[Job]:
+        """Следующая задача по кругу среди пользователей, у которых сейчас ничего не выполняется."""
+        for _ in range(len(cls._ready)):
+            user_id = cls._ready.popleft()
+            queue = cls._queues.get(user_id)
+            if not queue:
+                cls._queues.pop(user_id, None)
+                continue
+            if user_id in cls._running:
+                cls._ready.append(user_id)
+                continue
+
+            job = queue.popleft()
+            if queue:
+                cls._ready.append(user_id)
+            else:
+                del cls._queues[user_id]
+            return job
+        return None
+
+    @classmethod
+    async def _next_job(cls) -> Job:
+        async with cls._cond:
+            while True:
+                job = cls._pick()
+                if job is not None:
+                    cls._running[job.user_id] = job
+                    return job
+                await cls._cond.wait()
+
+    @staticmethod
+    async def _run(job: Job):
+        async with STAGE_SECONDS.time(stage=f"job:{job.kind}"):
+            if not job.profile:
+                return await job.func(job)
+            async with Profiler.profile(f"job{job.id}"):
+                return await job.func(job)
+
+    @classmethod
+    async def _worker(cls, index: int):
+        while True:
+            job = await cls._next_job()
+            logger.info(f"JobManager[{index}]: старт задачи #{job.id} ({job.title}).")
+            job.task = asyncio.create_task(cls._run(job))
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                # Отменили задачу, а не сам воркер — продолжаем работу
+                if not job.task.cancelled():
+                    raise
+                if job.cancelled:
+                    cls._cancelled(job)
+                    await job.progress.finish(f"❌ {job.title}: отменено.")
+                else:
+                    await job.progress.finish(f"⏸ {job.title}: бот перезапускается.")
+            except Exception as e:
+                logger.error(f"JobManager: задача #{job.id} упала: {e}")
+                await job.progress.finish(f"❌ {job.title}: ошибка.")
+            finally:
+                async with cls._cond:
+                    cls._running.pop(job.user_id, None)
+                    cls._cond.notify_all()
+            logger.info(f"JobManager[{index}]: задача #{job.id} завершена.")
+
+
+JOB_QUEUE_DEPTH = Gauge("vkbot_job_queue_depth", "Задачи в очереди", func=JobManager.queued_count)
+JOBS_RUNNING = Gauge("vkbot_jobs_running", "Выполняющиеся задачи", func=JobManager.running_count)
@@ -0,0 +1,244 @@
+import bisect
+import contextvars
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+from aiohttp import web
+from loguru import logger
+
+from app.core.config import get_settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        Metrics.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), func: Callable[[], float] = None):
+        super().__init__(name, doc, labels)
+        # Значение без меток можно считать в момент опроса
+        self.func = func
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> list[str]:
+        if self.func is not None:
+            self._values[()] = self.func()
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = buckets
+        # Метки -> [счетчики по бакетам..., +Inf], сумма
+        self._series: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @asynccontextmanager
+    async def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """Реестр метрик и HTTP-эндпоинт в формате Prometheus (Singleton)."""
+    _registry: list[_Metric] = []
+    _runner: Optional[web.AppRunner] = None
+
+    @classmethod
+    def register(cls, metric: _Metric):
+        cls._registry.append(metric)
+
+    @classmethod
+    def render(cls) -> str:
+        lines = []
+        for metric in cls._registry:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    async def _handle_metrics(cls, request: web.Request) -> web.Response:
+        return web.Response(text=cls.render(), content_type="text/plain", charset="utf-8")
+
+    @classmethod
+    async def _handle_profile(cls, request: web.Request) -> web.Response:
+        count = int(request.query.get("count", 1))
+        Profiler.arm(count)
+        return web.Response(text=f"profiling armed for next {count} request(s)\n")
+
+    @classmethod
+    def make_app(cls) -> web.Application:
+        from app.core.health import Health  # health сам регистрирует метрики отсюда
+
+        app = web.Application()
+        app.router.add_get("/metrics", cls._handle_metrics)
+        app.router.add_post("/debug/profile", cls._handle_profile)
+        Health.register(app)
+        return app
+
+    @classmethod
+    async def start(cls):
+        settings = get_settings()
+        if not settings.METRICS_ENABLED or cls._runner is not None:
+            return
+        cls._runner = web.AppRunner(cls.make_app(), access_log=None)
+        await cls._runner.setup()
+        await web.TCPSite(cls._runner, settings.METRICS_HOST, settings.METRICS_PORT).start()
+        logger.info(f"Metrics: http://{settings.METRICS_HOST}:{settings.METRICS_PORT}/metrics")
+
+    @classmethod
+    async def stop(cls):
+        if cls._runner:
+            await cls._runner.cleanup()
+            cls._runner = None
+
+
+# Запрос (апдейт Telegram и порожденные им задачи), который надо профилировать
+profiling_requested: contextvars.ContextVar[bool] = contextvars.ContextVar("profiling_requested", default=False)
+
+
+class Profiler:
+    """
+    Профилирование по запросу: POST /debug/profile взводит его на следующие N запросов.
+    Результат (топ функций по cumulative) пишется в лог и в DATA_DIR/profiles/*.prof.
+    cProfile видит весь поток, поэтому в отчет попадет и параллельная работа.
+    Активен только один профиль за раз: второй cProfile в том же потоке
+    сбивает первый (а с Python 3.12 падает с ValueError).
+    """
+    _armed = 0
+    _active = False
+
+    @classmethod
+    def arm(cls, count: int = 1):
+        cls._armed = count
+
+    @classmethod
+    def take(cls) -> bool:
+        if cls._armed <= 0:
+            return False
+        cls._armed -= 1
+        return True
+
+    @classmethod
+    @asynccontextmanager
+    async def profile(cls, name: str):
+        if cls._active:
+            logger.info(f"Profiler [{name}]: уже идет другой профиль, пропускаем.")
+            yield
+            return
+
+        cls._active = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            cls._active = False
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(30)
+            logger.info(f"Profiler [{name}]:\n{out.getvalue()}")
+
+            path = Path(get_settings().DATA_DIR) / "profiles"
+            path.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(path / f"{name}_{int(time.time())}.prof")
+
+
+# --- МЕТРИКИ БОТА ---
+STAGE_SECONDS = Histogram(
+    "vkbot_stage_seconds", "Время этапов обработки", ("stage",)
+)
+VK_API_SECONDS = Histogram(
+    "vkbot_vk_api_seconds", "Время вызовов VK API", ("method",)
+)
+RETRIES = Counter(
+    "vkbot_retries_total", "Повторы после сбоев", ("kind",)
+)
+FLOOD_WAITS = Counter(
+    "vkbot_flood_waits_total", "Флуд-ошибки и вынужденные паузы", ("api",)
+)
+INFLIGHT_BYTES = Gauge(
+    "vkbot_inflight_bytes", "Скачанные, но еще не отправленные байты фото"
+)
+IMAGE_POOL_INFLIGHT = Gauge(
+    "vkbot_image_pool_inflight", "Задачи в пуле процессов предобработки"
+)
+ALBUM_ASSEMBLY_SECONDS = Histogram(
+    "vkbot_album_assembly_seconds", "Время сборки медиагруппы в AlbumMiddleware",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2)
+)
+THREADS = Gauge(
+    "vkbot_threads", "Живые потоки процесса", func=threading.active_count
+)
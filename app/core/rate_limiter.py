@@ -0,0 +1,164 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from aiogram.exceptions import TelegramRetryAfter
+from loguru import logger
+
+from app.core.config import get_settings
+from app.core.metrics import FLOOD_WAITS, Histogram
+
+T = TypeVar("T")
+
+# Методы ВК, которые создают контент: у них отдельный, более строгий лимит (flood control)
+VK_WRITE_METHODS = ("photos.save", "photos.saveWallPhoto", "wall.post")
+
+# Сколько per-chat бакетов держим, прежде чем чистить неактивные
+MAX_CHAT_BUCKETS = 10_000
+
+RATE_WAIT_SECONDS = Histogram("vkbot_rate_wait_seconds", "Ожидание в лимитере запросов", ("api",))
+
+
+class TokenBucket:
+    """
+    Token bucket с адаптивной скоростью (AIMD).
+    При флуд-ошибке скорость падает вдвое и бакет блокируется на указанное время,
+    каждый успешный вызов понемногу возвращает скорость к базовой.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 8
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        # Запрос дороже емкости иначе не дождался бы никогда
+        tokens = min(tokens, self.capacity)
+        # Лок дает очередь FIFO: ждущие не обгоняют друг друга
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= tokens:
+                        self.tokens -= tokens
+                        return
+                    wait = (tokens - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def penalize(self, delay: float):
+        now = time.monotonic()
+        self._refill(now)
+        self.blocked_until = max(self.blocked_until, now + delay)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+
+    def reward(self):
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * 0.05)
+
+    @property
+    def idle(self) -> bool:
+        return self.tokens >= self.capacity and self.blocked_until <= time.monotonic() and not self._lock.locked()
+
+
+class RateLimiter:
+    """
+    Общий планировщик лимитов для ВК и Telegram (Singleton).
+    Бакеты: "vk" — все методы ВК, "vk:write" — создающие контент,
+    "tg" — Telegram целиком, "tg:chat:<id>" — отдельный чат.
+    """
+    _buckets: dict[str, TokenBucket] = {}
+
+    @staticmethod
+    def _make_bucket(key: str) -> TokenBucket:
+        settings = get_settings()
+        if key == "vk":
+            return TokenBucket(settings.VK_RATE, settings.VK_RATE)
+        if key == "vk:write":
+            return TokenBucket(settings.VK_WRITE_RATE, 1)
+        if key == "tg":
+            return TokenBucket(settings.TG_GLOBAL_RATE, settings.TG_GLOBAL_RATE)
+        return TokenBucket(settings.TG_CHAT_RATE, settings.TG_CHAT_BURST)
+
+    @classmethod
+    def _bucket(cls, key: str) -> TokenBucket:
+        bucket = cls._buckets.get(key)
+        if bucket is None:
+            if len(cls._buckets) >= MAX_CHAT_BUCKETS:
+                cls._cleanup()
+            bucket = cls._buckets[key] = cls._make_bucket(key)
+        return bucket
+
+    @classmethod
+    def _cleanup(cls):
+        for key in [k for k, b in cls._buckets.items() if k.startswith("tg:chat:") and b.idle]:
+            del cls._buckets[key]
+
+    # --- ВКонтакте ---
+    @staticmethod
+    def _vk_keys(method: str) -> list[str]:
+        return ["vk", "vk:write"] if method in VK_WRITE_METHODS else ["vk"]
+
+    @classmethod
+    async def acquire_vk(cls, method: str):
+        async with RATE_WAIT_SECONDS.time(api="vk"):
+            for key in cls._vk_keys(method):
+                await cls._bucket(key).acquire()
+
+    @classmethod
+    async def acquire_vk_write(cls):
+        """Токен записи за пачку сохранений в одном execute: сам execute пишущим не считается."""
+        async with RATE_WAIT_SECONDS.time(api="vk"):
+            await cls._bucket("vk:write").acquire()
+
+    @classmethod
+    def vk_success(cls, method: str):
+        for key in cls._vk_keys(method):
+            cls._bucket(key).reward()
+
+    @classmethod
+    def vk_flood(cls, method: str, code: int):
+        """6 — слишком много запросов в секунду (тормозим всё), 9 — флуд однотипными действиями."""
+        settings = get_settings()
+        FLOOD_WAITS.inc(api=f"vk:{code}")
+        if code == 6:
+            cls._bucket("vk").penalize(1.0)
+        else:
+            cls._bucket(cls._vk_keys(method)[-1]).penalize(settings.VK_FLOOD_PAUSE)
+        logger.warning(f"RateLimiter: VK flood ({code}) на {method}, снижаем скорость")
+
+    # --- Telegram ---
+    @classmethod
+    async def telegram(cls, chat_id: int, call: Callable[[], Awaitable[T]], cost: int = 1, attempts: int = 3) -> T:
+        """
+        Выполняет запрос к Bot API в рамках лимитов чата и бота.
+        cost — сколько сообщений породит запрос (для медиагруппы — число фото).
+        На 429 ждем retry_after, который назвал Telegram, и повторяем.
+        """
+        chat_key = f"tg:chat:{chat_id}"
+        for attempt in range(1, attempts + 1):
+            async with RATE_WAIT_SECONDS.time(api="telegram"):
+                await cls._bucket(chat_key).acquire()
+                await cls._bucket("tg").acquire(cost)
+            try:
+                result = await call()
+            except TelegramRetryAfter as e:
+                cls._bucket(chat_key).penalize(e.retry_after)
+                FLOOD_WAITS.inc(api="telegram")
+                logger.warning(f"RateLimiter: Telegram 429 в чате {chat_id}, ждем {e.retry_after} c")
+                if attempt == attempts:
+                    raise
+                continue
+            cls._bucket(chat_key).reward()
+            return result
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram import Bot, types
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from loguru import logger
+
+from app.core.config import get_settings
+from app.core.database import open_db, retry_busy
+
+# Как часто опрашиваем общую базу, ожидая новые части медиагруппы
+ALBUM_POLL_INTERVAL = 0.05
+# Части медиагрупп старше этого (сек) — мусор от упавших воркеров
+ALBUM_STALE_AFTER = 60.0
+# Доска задач: как часто воркер отчитывается и забирает отмены,
+# через сколько секунд молчания его задачи не считаются, сколько живет запрос отмены
+JOB_BOARD_INTERVAL = 1.0
+JOB_BOARD_STALE = 5.0
+JOB_CANCEL_TTL = 60.0
+# Общая база состояния: ее делят все воркеры на одной машине (один DATA_DIR)
+SHARED_STATE_DB = "shared_state.sqlite3"
+
+
+# --- СОСТОЯНИЕ FSM ---
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram на SQLite: состояние пользователя видят все воркеры,
+    поэтому команда и ответ на нее могут попасть в разные процессы.
+    """
+
+    def __init__(self):
+        self._conn = open_db(
+            SHARED_STATE_DB,
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')"
+        )
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.business_connection_id}:{key.destiny}"
+
+    def _write(self, sql: str, params: tuple):
+        with self._conn:
+            self._conn.execute(sql, params)
+
+    def _read(self, column: str, key: StorageKey) -> Optional[tuple]:
+        return self._conn.execute(f"SELECT {column} FROM fsm WHERE key = ?", (self._key(key),)).fetchone()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await retry_busy(lambda: self._write(
+            "INSERT INTO fsm (key, state) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET state = excluded.state",
+            (self._key(key), state)
+        ))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await retry_busy(lambda: self._read("state", key))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await retry_busy(lambda: self._write(
+            "INSERT INTO fsm (key, data) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET data = excluded.data",
+            (self._key(key), json.dumps(dict(data)))
+        ))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await retry_busy(lambda: self._read("data", key))
+        return json.loads(row[0]) if row else {}
+
+    async def close(self) -> None:
+        self._conn.close()
+
+
+# --- СБОРКА МЕДИАГРУПП ---
+
+class AlbumStore(ABC):
+    """
+    Где AlbumMiddleware копит части медиагруппы. Первая часть делает
+    воркер «ведущим»: он ждет остальные и отдает группу хендлеру целиком.
+    """
+
+    @abstractmethod
+    async def join(self, key: str, message: types.Message) -> bool:
+        """Добавляет часть; True — эта часть первая и группу собирает вызывающий."""
+
+    @abstractmethod
+    async def wait(self, key: str, known: int, timeout: float) -> int:
+        """Ждет, пока частей станет больше known (не дольше timeout); возвращает их число."""
+
+    @abstractmethod
+    async def pop(self, key: str, bot: Bot) -> list[types.Message]:
+        """Забирает все части группы и удаляет ее."""
+
+
+class MemoryAlbumStore(AlbumStore):
+    """Части в памяти процесса: подходит, когда все апдейты идут в один процесс."""
+
+    def __init__(self, max_groups: int = 1000):
+        self.max_groups = max_groups
+        self.groups: OrderedDict[str, dict] = OrderedDict()
+
+    async def join(self, key: str, message: types.Message) -> bool:
+        group = self.groups.get(key)
+        if group is not None:
+            group["messages"].append(message)
+            # Будим ведущего: он перезапустит таймер или сразу заберет полную группу
+            group["updated"].set()
+            return False
+
+        self.groups[key] = {"messages": [message], "updated": asyncio.Event()}
+        while len(self.groups) > self.max_groups:
+            evicted, _ = self.groups.popitem(last=False)
+            logger.warning(f"AlbumStore: вытеснена незавершенная группа {evicted}")
+        return True
+
+    async def wait(self, key: str, known: int, timeout: float) -> int:
+        group = self.groups.get(key)
+        if group is None:
+            return known
+        group["updated"].clear()
+        if len(group["messages"]) <= known:
+            try:
+                await asyncio.wait_for(group["updated"].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return len(group["messages"])
+
+    async def pop(self, key: str, bot: Bot) -> list[types.Message]:
+        group = self.groups.pop(key, None)
+        return group["messages"] if group else []
+
+
+class SQLiteAlbumStore(AlbumStore):
+    """
+    Части в общей SQLite-базе: части одной группы могут прийти в разные воркеры.
+    Ведущим становится тот, чья вставка группы прошла первой.
+    """
+
+    def __init__(self):
+        self._conn = open_db(
+            SHARED_STATE_DB,
+            "CREATE TABLE IF NOT EXISTS album_groups (key TEXT PRIMARY KEY, started REAL NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS album_parts ("
+            " key TEXT NOT NULL, message_id INTEGER NOT NULL, payload TEXT NOT NULL,"
+            " PRIMARY KEY (key, message_id))"
+        )
+
+    def _join(self, key: str, message: types.Message) -> bool:
+        now = time.time()
+        with self._conn:
+            # Группы, которые никто не забрал (ведущий упал), не копим вечно
+            self._conn.execute("DELETE FROM album_parts WHERE key IN "
+                               "(SELECT key FROM album_groups WHERE started < ?)", (now - ALBUM_STALE_AFTER,))
+            self._conn.execute("DELETE FROM album_groups WHERE started < ?", (now - ALBUM_STALE_AFTER,))
+            self._conn.execute(
+                "INSERT OR IGNORE INTO album_parts (key, message_id, payload) VALUES (?, ?, ?)",
+                (key, message.message_id, message.model_dump_json(exclude_none=True, by_alias=True))
+            )
+            leader = self._conn.execute(
+                "INSERT OR IGNORE INTO album_groups (key, started) VALUES (?, ?)", (key, now)
+            ).rowcount == 1
+        return leader
+
+    async def join(self, key: str, message: types.Message) -> bool:
+        return await retry_busy(lambda: self._join(key, message))
+
+    def _count(self, key: str) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM album_parts WHERE key = ?", (key,)).fetchone()[0]
+
+    async def wait(self, key: str, known: int, timeout: float) -> int:
+        deadline = time.monotonic() + timeout
+        while True:
+            count = await retry_busy(lambda: self._count(key))
+            left = deadline - time.monotonic()
+            if count > known or left <= 0:
+                return count
+            await asyncio.sleep(min(ALBUM_POLL_INTERVAL, left))
+
+    def _pop(self, key: str) -> list[tuple]:
+        with self._conn:
+            rows = self._conn.execute(
+                "SELECT payload FROM album_parts WHERE key = ? ORDER BY message_id", (key,)
+            ).fetchall()
+            self._conn.execute("DELETE FROM album_parts WHERE key = ?", (key,))
+            self._conn.execute("DELETE FROM album_groups WHERE key = ?", (key,))
+        return rows
+
+    async def pop(self, key: str, bot: Bot) -> list[types.Message]:
+        rows = await retry_busy(lambda: self._pop(key))
+        return [types.Message.model_validate_json(payload, context={"bot": bot}) for payload, in rows]
+
+
+# --- ФОНОВЫЕ ЗАДАЧИ ---
+
+class JobBoard:
+    """
+    Общая доска фоновых задач: очередь JobManager у каждого воркера своя,
+    а /cancel может прийти в любой. Воркеры раз в JOB_BOARD_INTERVAL
+    публикуют, у кого сколько задач, и забирают запросы отмены.
+    """
+
+    def __init__(self, worker: str):
+        self.worker = worker
+        self._conn = open_db(
+            SHARED_STATE_DB,
+            "CREATE TABLE IF NOT EXISTS job_workers ("
+            " worker TEXT NOT NULL, user_id INTEGER NOT NULL, jobs INTEGER NOT NULL, seen REAL NOT NULL,"
+            " PRIMARY KEY (worker, user_id))",
+            "CREATE TABLE IF NOT EXISTS job_cancels (user_id INTEGER PRIMARY KEY, requested REAL NOT NULL)"
+        )
+
+    def _request_cancel(self, user_id: int, requested: float) -> int:
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO job_cancels (user_id, requested) VALUES (?, ?)"
+                " ON CONFLICT (user_id) DO UPDATE SET requested = excluded.requested",
+                (user_id, requested)
+            )
+            row = self._conn.execute(
+                "SELECT SUM(jobs) FROM job_workers WHERE user_id = ? AND worker != ? AND seen > ?",
+                (user_id, self.worker, requested - JOB_BOARD_STALE)
+            ).fetchone()
+        return row[0] or 0
+
+    async def request_cancel(self, user_id: int, requested: float) -> int:
+        """Просит все воркеры отменить задачи пользователя, поставленные до requested; возвращает их число у других воркеров."""
+        return await retry_busy(lambda: self._request_cancel(user_id, requested))
+
+    def _sync(self, jobs: dict[int, int]) -> dict[int, float]:
+        now = time.time()
+        with self._conn:
+            self._conn.execute("DELETE FROM job_workers WHERE worker = ? OR seen < ?", (self.worker, now - JOB_CANCEL_TTL))
+            self._conn.executemany(
+                "INSERT INTO job_workers (worker, user_id, jobs, seen) VALUES (?, ?, ?, ?)",
+                [(self.worker, user_id, count, now) for user_id, count in jobs.items()]
+            )
+            self._conn.execute("DELETE FROM job_cancels WHERE requested < ?", (now - JOB_CANCEL_TTL,))
+            return dict(self._conn.execute("SELECT user_id, requested FROM job_cancels"))
+
+    async def sync(self, jobs: dict[int, int]) -> dict[int, float]:
+        """Публикует число задач воркера по пользователям; возвращает запросы отмены (user_id -> время)."""
+        return await retry_busy(lambda: self._sync(jobs))
+
+    async def leave(self):
+        try:
+            await retry_busy(lambda: self._sync({}))
+        finally:
+            self._conn.close()
+
+
+# --- ВЫБОР ХРАНИЛИЩА ---
+
+def create_fsm_storage() -> BaseStorage:
+    """STATE_STORAGE=memory — в памяти процесса, sqlite — общее для всех воркеров."""
+    if get_settings().STATE_STORAGE == "sqlite":
+        return SQLiteStorage()
+    return MemoryStorage()
+
+
+def create_album_store() -> AlbumStore:
+    if get_settings().STATE_STORAGE == "sqlite":
+        return SQLiteAlbumStore()
+    return MemoryAlbumStore()
+
+
+def create_job_board(worker: str) -> Optional[JobBoard]:
+    """Доска нужна, только когда воркеров несколько и состояние общее; иначе отмена локальная."""
+    if get_settings().STATE_STORAGE == "sqlite":
+        return JobBoard(worker)
+    return None
@@ -0,0 +1,71 @@
+import asyncio
+import io
+import tempfile
+from collections import deque
+from typing import AsyncIterator, BinaryIO, Optional
+
+from aiogram import Bot, types
+from loguru import logger
+
+from app.core.config import get_settings
+from app.core.image_processing import ImageProcessor
+
+
+def _new_spool(size: Optional[int]) -> BinaryIO:
+    """Небольшие файлы держим в памяти, крупные и неизвестного размера — во временном файле на диске."""
+    if size is not None and size <= get_settings().SPOOL_MAX_MEMORY:
+        return io.BytesIO()
+    return tempfile.TemporaryFile()
+
+
+async def _download_photo(bot: Bot, photo: types.PhotoSize, profile: str = "") -> BinaryIO:
+    f = _new_spool(photo.file_size)
+    try:
+        await bot.download(photo.file_id, destination=f)
+    except BaseException:
+        f.close()
+        raise
+    f.seek(0)
+    if not ImageProcessor.get_profile(profile):
+        return f
+
+    with f:
+        data = await ImageProcessor.process(f.read(), profile)
+    return io.BytesIO(data)
+
+
+async def iter_telegram_photos(bot: Bot, messages: list[types.Message], profile: str = "") -> AsyncIterator[BinaryIO]:
+    """
+    Потоково отдает фото из сообщений (лучшее качество) в порядке альбома.
+    Если задан профиль, фото приводятся к нему в пуле процессов (см. ImageProcessor).
+
+    Следующие TRANSFER_PREFETCH файлов скачиваются, пока потребитель
+    загружает текущий в ВК, поэтому память на пользователя не зависит
+    от размера альбома. Потребитель закрывает полученные файлы сам.
+    """
+    prefetch = get_settings().TRANSFER_PREFETCH
+    source = iter(messages)
+    pending: deque[asyncio.Task] = deque()
+
+    def schedule():
+        while len(pending) <= prefetch:
+            msg = next(source, None)
+            if msg is None:
+                return
+            pending.append(asyncio.create_task(_download_photo(bot, msg.photo[-1], profile)))
+
+    try:
+        schedule()
+        while pending:
+            f = await pending.popleft()
+            schedule()
+            yield f
+    finally:
+        # Прервали на середине — не оставляем висящих загрузок и открытых файлов
+        for task in pending:
+            task.cancel()
+        for result in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(result, BaseException):
+                logger.debug(f"Transfer: загрузка прервана: {result!r}")
+            else:
+                result.close()
@@ -0,0 +1,154 @@
+from typing import Any, Optional
+
+import time
+import httpx
+from loguru import logger
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception
+
+from app.core.http_client import HTTPClient
+from app.core.metrics import RETRIES, VK_API_SECONDS
+from app.core.rate_limiter import RateLimiter
+
+VK_API_URL = "https://api.vk.com/method/"
+VK_API_VERSION = "5.199"
+
+
+# --- ОШИБКИ VK API ---
+# См. док: https://dev.vk.com/ru/reference/errors
+
+class VKAPIError(Exception):
+    """Ошибка, которую вернул VK API (поле error в ответе)."""
+
+    def __init__(self, code: int, message: str, method: str = None):
+        self.code = code
+        self.message = message
+        self.method = method
+        super().__init__(f"[{code}] {message} ({method})")
+
+
+class VKAuthError(VKAPIError):
+    """5 — невалидный или просроченный токен."""
+
+
+class VKTooManyRequests(VKAPIError):
+    """6 — превышен лимит запросов в секунду."""
+
+
+class VKFloodControl(VKAPIError):
+    """9 — слишком много однотипных действий."""
+
+
+class VKInternalError(VKAPIError):
+    """10 — внутренняя ошибка сервера ВК."""
+
+
+class VKAccessDenied(VKAPIError):
+    """15, 18, 30, 200, 203 — нет доступа к объекту (закрытый альбом, удаленный профиль и т.п.)."""
+
+
+ERROR_CLASSES = {
+    5: VKAuthError,
+    6: VKTooManyRequests,
+    9: VKFloodControl,
+    10: VKInternalError,
+    15: VKAccessDenied,
+    18: VKAccessDenied,
+    30: VKAccessDenied,
+    200: VKAccessDenied,
+    203: VKAccessDenied,
+}
+
+
+def make_api_error(error: dict, method: str = None) -> VKAPIError:
+    code = error.get("error_code", 0)
+    error_cls = ERROR_CLASSES.get(code, VKAPIError)
+    return error_cls(code, error.get("error_msg", "Unknown error"), method)
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Повторяем сетевые сбои, 5xx и временные ошибки ВК."""
+    if isinstance(exc, (VKTooManyRequests, VKFloodControl, VKInternalError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.RequestError)
+
+
+def _count_retry(retry_state):
+    RETRIES.inc(kind="vk")
+
+
+RETRY_CONFIG = {
+    "stop": stop_after_attempt(3),
+    # Паузу на флуд держит RateLimiter, здесь — только разнесение повторов
+    "wait": wait_exponential_jitter(initial=0.5, max=8),
+    "retry": retry_if_exception(_is_retryable),
+    "before_sleep": _count_retry,
+    "reraise": True
+}
+
+
+def _serialize(value: Any) -> Any:
+    """VK ждет списки через запятую и флаги 1/0."""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (list, tuple, set)):
+        return ",".join(str(v) for v in value)
+    return value
+
+
+class VKClient:
+    """
+    Асинхронный клиент VK API поверх общего HTTPClient.
+    Не занимает потоков: все запросы идут через пул соединений httpx.
+    """
+
+    def __init__(self, token: str, version: str = VK_API_VERSION, api_url: str = VK_API_URL):
+        self._token = token
+        self.version = version
+        self.api_url = api_url
+
+    @retry(**RETRY_CONFIG)
+    async def call(self, method: str, **params) -> Any:
+        """Вызывает метод API и возвращает поле response."""
+        data = {k: _serialize(v) for k, v in params.items() if v is not None}
+        data["access_token"] = self._token
+        data["v"] = self.version
+
+        await RateLimiter.acquire_vk(method)
+        client = HTTPClient.get_client()
+        started = time.perf_counter()
+        try:
+            response = await client.post(self.api_url + method, data=data)
+        finally:
+            VK_API_SECONDS.observe(time.perf_counter() - started, method=method)
+        response.raise_for_status()
+        payload = response.json()
+
+        if "error" in payload:
+            error = make_api_error(payload["error"], method)
+            if isinstance(error, (VKTooManyRequests, VKFloodControl)):
+                RateLimiter.vk_flood(method, error.code)
+            raise error
+        RateLimiter.vk_success(method)
+        return payload["response"]
+
+    @staticmethod
+    async def upload(upload_url: str, files: dict, data: Optional[dict] = None) -> dict:
+        """
+        Отправляет multipart-запрос на сервер загрузки ВК.
+        files: {"file1": (имя, файл, mime), ...}
+        """
+        client = HTTPClient.get_client()
+        async with VK_API_SECONDS.time(method="upload"):
+            response = await client.post(upload_url, files=files, data=data)
+        response.raise_for_status()
+        payload = response.json()
+
+        if "error" in payload:
+            error = payload["error"]
+            if isinstance(error, dict):
+                raise make_api_error(error, "upload")
+            logger.error(f"VK upload error: {payload}")
+            raise VKAPIError(0, str(error), "upload")
+        return payload
@@ -1,45 +1,150 @@
 import asyncio
+import json
 import re
-import vk_api
-from vk_api.upload import VkUpload
-from vk_api.exceptions import ApiHttpError, ApiError
-from requests.exceptions import RequestException, ConnectionError, Timeout
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Iterable, Optional, Union
 from loguru import logger
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
+from tenacity import retry
 from app.core.config import get_settings
+from app.core.album_cache import AlbumListing, AlbumListingCache, Fingerprint
+from app.core.metrics import STAGE_SECONDS
+from app.core.rate_limiter import RateLimiter, VK_WRITE_METHODS
+from app.core.vk_client import VKClient, VKAPIError, VKAuthError, RETRY_CONFIG
 
-RETRY_CONFIG = {
-    "stop": stop_after_attempt(3),
-    "wait": wait_fixed(2),
-    "retry": retry_if_exception_type((
-        ApiHttpError, RequestException, ConnectionError, Timeout
-    )),
-    "reraise": True
+# Сервер загрузки в альбом принимает до 5 файлов за запрос
+UPLOAD_CHUNK_SIZE = 5
+# Больше 25 вызовов API в один execute не помещается
+EXECUTE_MAX_CALLS = 25
+# Максимальный count для photos.get / photos.getUserPhotos
+PAGE_SIZE = 1000
+
+# Проверка токена при старте: пауза между попытками растет от первой до второй (сек)
+START_RETRY_DELAYS = (1.0, 60.0)
+
+# Файлы для загрузки: готовый список или поток (см. app.core.transfer)
+Files = Union[Iterable[BinaryIO], AsyncIterable[BinaryIO]]
+
+
+# Вариант размера фото: (тип, большая сторона в px, url)
+SizeVariant = tuple[str, int, str]
+
+# Системные альбомы в photos.getAlbums(need_system=1) -> album_id для photos.get
+SYSTEM_ALBUMS = {-6: 'profile', -7: 'wall', -15: 'saved'}
+
+# Профили качества: предел большой стороны (None — самый большой размер).
+# Telegram показывает фото не крупнее 1280px — у ВК под это попадает z (1080px), а не w (2560px);
+# превью хватает 604px
+QUALITY_PROFILES = {
+    "original": None,
+    "telegram-optimal": 1280,
+    "preview": 604,
+}
+
+# Размеры типов без width/height (старые фото).
+# См. док: https://dev.vk.com/ru/reference/objects/photo-sizes
+NOMINAL_SIDE = {
+    's': 75, 'm': 130, 'x': 604, 'y': 807, 'z': 1080, 'w': 2560,
+    'o': 130, 'p': 200, 'q': 320, 'r': 510,
 }
+# Обрезанные копии для превью, в выдачу не годятся
+CROPPED_TYPES = {'o', 'p', 'q', 'r'}
+
+
+@dataclass(slots=True)
+class PhotoRecord:
+    """
+    Фото из альбома в компактном виде: все размеры плюс выбранный
+    под профиль качества (url/size заполняет VKService.with_quality).
+    """
+    owner_id: int
+    id: int
+    sizes: tuple[SizeVariant, ...] = ()
+    url: str = ''
+    size: str = ''
+
+    @property
+    def cache_key(self) -> str:
+        """Ключ фото в кэше file_id: одно и то же фото в разных размерах — разные файлы."""
+        return f"{self.owner_id}_{self.id}:{self.size}"
+
+
+@dataclass(slots=True)
+class PhotoPage:
+    """Страница обхода альбома; total — сколько фото в альбоме всего."""
+    total: int
+    photos: list[PhotoRecord]
+
+
+@dataclass(slots=True)
+class AlbumInfo:
+    """Альбом для выгрузки; size уточняется при сканировании."""
+    owner_id: int
+    album_id: str
+    title: str = ''
+    size: int = 0
+
+    @property
+    def name(self) -> str:
+        return self.title or f"album{self.owner_id}_{self.album_id}"
 
 
 class VKService:
-    _session = None
-    _api = None
+    _client: VKClient = None
+    _user_id: Optional[int] = None
+    _album_cache: AlbumListingCache = None
+    # (метод, параметры) -> (upload_url, момент устаревания)
+    _upload_servers: dict[tuple, tuple[str, float]] = {}
 
     @classmethod
-    def start(cls):
-        if cls._api is None:
+    def init(cls):
+        """Создает клиента без обращения к сети: после этого сервисом уже можно пользоваться."""
+        if cls._client is None:
+            settings = get_settings()
+            cls._client = VKClient(token=settings.VK_TOKEN.get_secret_value(), api_url=settings.VK_API_URL)
+            cls._album_cache = AlbumListingCache(
+                ttl=settings.ALBUM_CACHE_TTL, max_photos=settings.ALBUM_CACHE_MAX_PHOTOS
+            )
+
+    @classmethod
+    async def start(cls):
+        """
+        Инициализация и проверка токена (users.get); при старте бота идет фоном.
+        Сетевые сбои не навсегда: повторяем с растущей паузой, пока ВК не ответит.
+        Сдаемся только на невалидном токене.
+        """
+        cls.init()
+        delay, max_delay = START_RETRY_DELAYS
+        while True:
             try:
-                settings = get_settings()
-                logger.info("VKService: Инициализация...")
-                cls._session = vk_api.VkApi(token=settings.VK_TOKEN.get_secret_value())
-                cls._api = cls._session.get_api()
-                cls._check_connection()
+                logger.info("VKService: Проверка соединения...")
+                await cls._check_connection()
                 logger.info("VKService: Готов.")
-            except Exception as e:
+                return
+            except VKAuthError as e:
                 logger.critical(f"VKService Error: {e}")
                 raise e
+            except Exception as e:
+                logger.error(f"VKService: ВК недоступен ({e}), повтор через {delay:.0f} c")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
 
     @classmethod
-    @retry(**RETRY_CONFIG)
-    def _check_connection(cls):
-        cls._api.users.get()
+    async def _check_connection(cls):
+        users = await cls._client.call("users.get")
+        # С токеном сообщества список пустой
+        cls._user_id = users[0]['id'] if users else None
+
+    @classmethod
+    def get_user_id(cls) -> Optional[int]:
+        """ID пользователя-владельца токена (None для токена сообщества)."""
+        return cls._user_id
+
+    @classmethod
+    def _get_client(cls) -> VKClient:
+        if cls._client is None: raise RuntimeError("VKService not started")
+        return cls._client
 
     @staticmethod
     def parse_link(link: str):
@@ -61,124 +166,458 @@ class VKService:
                 return owner_id, album_str
         return None, None
 
-    # --- НОВЫЙ МЕТОД ВЫБОРА РАЗМЕРА ---
+    @classmethod
+    def parse_links(cls, text: str) -> list[tuple[int, str]]:
+        """Все ссылки на альбомы из сообщения, без повторов, в порядке появления."""
+        links = []
+        for token in text.split():
+            link = cls.parse_link(token)
+            if link[0] and link not in links:
+                links.append(link)
+        return links
+
     @staticmethod
-    def _get_best_size(sizes: list) -> str:
+    def parse_owner(text: str) -> Optional[int]:
+        """Владелец для выгрузки всех альбомов: vk.com/albums-123, id123, club123/public123 или просто ID."""
+        text = text.strip().rstrip('/')
+        match = re.search(r'albums(-?\d+)$', text) or re.fullmatch(r'-?\d+', text)
+        if match:
+            return int(match.group(match.lastindex or 0))
+        match = re.search(r'(?:^|/)(id|club|public|event)(\d+)$', text)
+        if match:
+            owner_id = int(match.group(2))
+            return owner_id if match.group(1) == 'id' else -owner_id
+        return None
+
+    @classmethod
+    async def get_albums(cls, owner_id: int) -> list[AlbumInfo]:
+        """Непустые альбомы владельца, включая системные (стена, фото профиля, сохраненные)."""
+        response = await cls._get_client().call("photos.getAlbums", owner_id=owner_id, need_system=1)
+        albums = []
+        for item in response.get('items', []):
+            album_id = SYSTEM_ALBUMS.get(item['id']) if item['id'] < 0 else str(item['id'])
+            if album_id and item.get('size', 0):
+                albums.append(AlbumInfo(owner_id, album_id, title=item.get('title', ''), size=item['size']))
+        return albums
+
+    # --- ВЫБОР РАЗМЕРА ---
+    @staticmethod
+    def _compact_sizes(sizes: list) -> tuple[SizeVariant, ...]:
         """
-        Выбирает ссылку на фото максимального качества,
-        опираясь на приоритеты типов размеров ВК.
+        Сжимает список sizes до кортежей (тип, большая сторона, url).
+        Обрезанные варианты o/p/q/r оставляем, только если других нет.
         """
-        if not sizes:
-            return None
+        variants = []
+        cropped = []
+        for size in sizes:
+            url = size.get('url')
+            if not url:
+                continue
+            size_type = size.get('type', '')
+            side = max(size.get('width', 0), size.get('height', 0)) or NOMINAL_SIDE.get(size_type, 0)
+            (cropped if size_type in CROPPED_TYPES else variants).append((size_type, side, url))
+        return tuple(variants or cropped)
+
+    @staticmethod
+    def choose_size(sizes: tuple[SizeVariant, ...], target: Optional[int]) -> Optional[SizeVariant]:
+        """
+        Самый крупный вариант, у которого большая сторона не больше target;
+        если все крупнее — самый маленький из них. target=None — самый большой.
+        Один проход по списку.
+        """
+        best = None
+        smallest = None
+        largest = None
+        for variant in sizes:
+            side = variant[1]
+            if largest is None or side > largest[1]:
+                largest = variant
+            if smallest is None or side < smallest[1]:
+                smallest = variant
+            if target is not None and side <= target and (best is None or side > best[1]):
+                best = variant
+        if target is None:
+            return largest
+        return best or smallest
 
-        # Приоритет типов (w - самый большой, s - самый маленький)
-        # См. док: https://dev.vk.com/ru/reference/objects/photo-sizes
-        type_priority = {
-            'w': 10,  # Около 2560px
-            'z': 9,  # 1080x1024
-            'y': 8,  # 807x807
-            'x': 7,  # 604x604
-            'm': 6,  # 130x87
-            's': 5,  # 75x55
-            # Остальные (редкие типы)
-            'o': 4, 'p': 3, 'q': 2, 'r': 1
+    @classmethod
+    def with_quality(cls, photo: PhotoRecord, quality: str) -> PhotoRecord:
+        """Копия записи с url и типом размера, выбранными под профиль качества."""
+        variant = cls.choose_size(photo.sizes, QUALITY_PROFILES.get(quality))
+        return replace(photo, size=variant[0], url=variant[2])
+
+    # --- СКАЧИВАНИЕ ---
+    @staticmethod
+    def _page_request(owner_id: int, album_id: str, offset: int) -> tuple[str, dict]:
+        """Метод и параметры для одной страницы альбома."""
+        if album_id == 'tagged':
+            return "photos.getUserPhotos", {
+                "user_id": owner_id, "sort": 'date', "count": PAGE_SIZE, "offset": offset, "photo_sizes": 1
+            }
+        return "photos.get", {
+            "owner_id": owner_id, "album_id": album_id, "photo_sizes": 1, "offset": offset, "count": PAGE_SIZE
         }
 
-        # Сортируем список:
-        # 1. Сначала по приоритету типа (если есть 'w', он победит)
-        # 2. Если типы одинаковые или неизвестные, то по площади (ширина * высота)
-        sizes.sort(key=lambda x: (
-            type_priority.get(x.get('type'), 0),
-            x.get('width', 0) * x.get('height', 0)
-        ), reverse=True)
+    @classmethod
+    async def _fetch_page(cls, owner_id: int, album_id: str, offset: int) -> dict:
+        method, params = cls._page_request(owner_id, album_id, offset)
+        return await cls._get_client().call(method, **params)
 
-        return sizes[0]['url']
+    @staticmethod
+    def _execute_code(calls: list[tuple[str, dict]], suffix: str = "") -> str:
+        """VKScript для execute: массив результатов вызовов в том же порядке."""
+        parts = []
+        for method, params in calls:
+            params = {k: v for k, v in params.items() if v is not None}
+            parts.append(f"API.{method}({json.dumps(params)}){suffix}")
+        return f"return [{', '.join(parts)}];"
 
-    # --- СКАЧИВАНИЕ ---
     @classmethod
-    @retry(**RETRY_CONFIG)
-    def _get_photos_sync(cls, owner_id: int, album_id: str):
-        if cls._api is None: raise RuntimeError("VKService not started")
+    async def _fetch_pages_execute(cls, owner_id: int, album_id: str, offsets: list[int]) -> list[list]:
+        """
+        Забирает несколько страниц одним запросом execute.
+        Если execute не справился (лимит размера ответа и т.п.) — добираем страницы отдельными запросами.
+        """
+        calls = [cls._page_request(owner_id, album_id, offset) for offset in offsets]
+        code = cls._execute_code(calls, suffix=".items")
 
-        urls = []
-        offset = 0
-        count = 1000
+        try:
+            pages = await cls._get_client().call("execute", code=code)
+        except VKAPIError as e:
+            logger.warning(f"VK execute failed ({e}), fallback to single pages")
+            pages = [None] * len(offsets)
 
-        while True:
-            if album_id == 'tagged':
-                response = cls._api.photos.getUserPhotos(
-                    user_id=owner_id, sort='date', count=count, offset=offset, photo_sizes=1
-                )
-            else:
-                response = cls._api.photos.get(
-                    owner_id=owner_id, album_id=album_id, photo_sizes=1, offset=offset, count=count
-                )
+        # При частичной ошибке execute на месте страницы приходит false — добираем такие параллельно
+        missing = [i for i, items in enumerate(pages) if not isinstance(items, list)]
+        fetched = await asyncio.gather(*(cls._fetch_page(owner_id, album_id, offsets[i]) for i in missing))
+        for i, response in zip(missing, fetched):
+            pages[i] = response.get('items', [])
+        return pages
+
+    @classmethod
+    def _to_records(cls, items: list) -> list[PhotoRecord]:
+        """Сжимаем сырые объекты фото до записей: сам список sizes дальше не храним."""
+        records = []
+        for item in items:
+            if 'sizes' in item:
+                sizes = cls._compact_sizes(item['sizes'])
+                if sizes:
+                    records.append(PhotoRecord(owner_id=item['owner_id'], id=item['id'], sizes=sizes))
+        return records
+
+    @classmethod
+    async def _fetch_window_records(cls, owner_id: int, album_id: str, offsets: list[int]) -> list[list[PhotoRecord]]:
+        pages = await cls._fetch_pages_execute(owner_id, album_id, offsets)
+        return [cls._to_records(items) for items in pages]
+
+    @classmethod
+    async def _fetch_fingerprint(cls, owner_id: int, album_id: str) -> Fingerprint:
+        """Дешевая проверка изменений: одно фото, самое новое, плюс общее количество."""
+        if album_id == 'tagged':
+            response = await cls._get_client().call("photos.getUserPhotos", user_id=owner_id, sort=0, count=1)
+        else:
+            response = await cls._get_client().call("photos.get", owner_id=owner_id, album_id=album_id, rev=1, count=1)
+        items = response.get('items', [])
+        return response.get('count', 0), items[0]['id'] if items else None
+
+    @classmethod
+    async def _get_cached_listing(cls, owner_id: int, album_id: str) -> Optional[AlbumListing]:
+        if cls._album_cache is None:
+            return None
+        key = (owner_id, album_id)
+        entry = cls._album_cache.get(key)
+        if entry is None:
+            return None
+        if not cls._album_cache.is_fresh(entry):
+            if await cls._fetch_fingerprint(owner_id, album_id) != entry.fingerprint:
+                cls._album_cache.drop(key)
+                return None
+            cls._album_cache.touch(entry)
+        return entry
+
+    @classmethod
+    async def iter_photos(cls, owner_id: int, album_id: str) -> AsyncIterator[PhotoPage]:
+        """
+        Обход альбома с кэшем списков: неизменившийся альбом отдается из памяти,
+        иначе сканируется потоково и (если влезает в лимит) запоминается.
+        """
+        cached = await cls._get_cached_listing(owner_id, album_id)
+        if cached is not None:
+            logger.info(f"VKService: альбом {owner_id}_{album_id} взят из кэша ({len(cached.photos)} фото)")
+            for i in range(0, max(len(cached.photos), 1), PAGE_SIZE):
+                yield PhotoPage(total=cached.total, photos=cached.photos[i:i + PAGE_SIZE])
+            return
+
+        # Отпечаток снимаем до сканирования, параллельно с первой страницей
+        fingerprint_task = asyncio.create_task(cls._fetch_fingerprint(owner_id, album_id))
+        collected = [] if cls._album_cache is not None else None
+        total = 0
+        try:
+            async for page in cls._scan_photos(owner_id, album_id):
+                total = page.total
+                if collected is not None:
+                    if total > cls._album_cache.max_photos:
+                        collected = None
+                    else:
+                        collected.extend(page.photos)
+                yield page
+
+            if collected is not None:
+                try:
+                    fingerprint = await fingerprint_task
+                except Exception as e:
+                    logger.warning(f"VKService: не удалось снять отпечаток альбома, не кэшируем: {e}")
+                else:
+                    cls._album_cache.put((owner_id, album_id), fingerprint, total, collected)
+        finally:
+            fingerprint_task.cancel()
+
+    @classmethod
+    async def _scan_photos(cls, owner_id: int, album_id: str) -> AsyncIterator[PhotoPage]:
+        """
+        Потоковый обход альбома: отдает страницы по мере получения.
+        Первая страница уходит сразу, следующие окна execute качаются
+        заранее, но не больше VK_SCAN_CONCURRENCY окон одновременно —
+        память не зависит от размера альбома.
+        """
+        settings = get_settings()
+        started = time.monotonic()
 
-            items = response.get('items', [])
-            if not items: break
+        # Первая страница дает общее количество фото
+        first = await cls._fetch_page(owner_id, album_id, 0)
+        total = first.get('count', 0)
+        yielded = 0
+        page = PhotoPage(total=total, photos=cls._to_records(first.get('items', [])))
+        yielded += len(page.photos)
+        yield page
 
-            for item in items:
-                if 'sizes' in item:
-                    # Используем новый метод выбора
-                    best_url = cls._get_best_size(item['sizes'])
-                    if best_url:
-                        urls.append(best_url)
+        # Остальные окна смещений забираем через execute с ограниченным забеганием вперед
+        offsets = list(range(PAGE_SIZE, total, PAGE_SIZE))
+        windows = iter([
+            offsets[i:i + settings.VK_EXECUTE_PAGES]
+            for i in range(0, len(offsets), settings.VK_EXECUTE_PAGES)
+        ])
+        pending: deque[asyncio.Task] = deque()
 
-            offset += count
-            if offset >= response['count']: break
+        def schedule():
+            while len(pending) < settings.VK_SCAN_CONCURRENCY:
+                window = next(windows, None)
+                if window is None:
+                    return
+                pending.append(asyncio.create_task(cls._fetch_window_records(owner_id, album_id, window)))
+
+        try:
+            schedule()
+            while pending:
+                pages = await pending.popleft()
+                schedule()
+                for records in pages:
+                    yielded += len(records)
+                    yield PhotoPage(total=total, photos=records)
+        finally:
+            for task in pending:
+                task.cancel()
 
-        return urls
+        STAGE_SECONDS.observe(time.monotonic() - started, stage="vk_scan")
+        logger.info(
+            f"VKService: альбом {owner_id}_{album_id} пройден за {time.monotonic() - started:.2f} c "
+            f"({yielded} из {total} фото)"
+        )
 
     @classmethod
     async def get_photo_urls(cls, owner_id: int, album_id: str):
         try:
-            return await asyncio.to_thread(cls._get_photos_sync, owner_id, album_id)
+            return [
+                cls.with_quality(photo, "original").url
+                async for page in cls.iter_photos(owner_id, album_id) for photo in page.photos
+            ]
         except Exception as e:
             logger.error(f"Get photos error: {e}")
             return None
 
-    # --- ЗАГРУЗКА И ПОСТИНГ (ОСТАЮТСЯ КАК БЫЛИ) ---
+    # --- ЗАГРУЗКА И ПОСТИНГ ---
+    @staticmethod
+    def _as_upload_files(file_objs: list, field: str = "file{}") -> dict:
+        """Готовит файлы для multipart: перематывает и раздает имена полей file1..file5."""
+        files = {}
+        for i, f in enumerate(file_objs, start=1):
+            if hasattr(f, 'seek'): f.seek(0)
+            # У временных файлов name — это номер дескриптора, такое имя ВК не нужно
+            name = getattr(f, 'name', None)
+            if not isinstance(name, str):
+                name = f"photo_{i}.jpg"
+            files[field.format(i)] = (name, f, "image/jpeg")
+        return files
+
+    @staticmethod
+    async def _iter_chunks(file_objs: Files, size: int) -> AsyncIterator[list]:
+        """Режет поток файлов на пачки по мере поступления (список или async-итератор)."""
+        chunk = []
+        if hasattr(file_objs, '__aiter__'):
+            async for f in file_objs:
+                chunk.append(f)
+                if len(chunk) == size:
+                    yield chunk
+                    chunk = []
+        else:
+            for f in file_objs:
+                chunk.append(f)
+                if len(chunk) == size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _close_files(file_objs: list):
+        for f in file_objs:
+            if hasattr(f, 'close'): f.close()
+
+    @classmethod
+    async def _get_upload_server(cls, method: str, **params) -> str:
+        """Адрес сервера загрузки; переиспользуем его UPLOAD_SERVER_TTL секунд."""
+        key = (method, *sorted(params.items()))
+        cached = cls._upload_servers.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        server = await cls._get_client().call(method, **params)
+        cls._upload_servers[key] = (server['upload_url'], time.monotonic() + get_settings().UPLOAD_SERVER_TTL)
+        return server['upload_url']
+
+    @classmethod
+    def _forget_upload_server(cls, method: str, **params):
+        cls._upload_servers.pop((method, *sorted(params.items())), None)
+
     @classmethod
     @retry(**RETRY_CONFIG)
-    def _upload_album_sync(cls, file_objs: list, album_id: int, group_id: int = None):
-        for f in file_objs:
-            if hasattr(f, 'seek'): f.seek(0)
-        upload = VkUpload(cls._session)
-        return upload.photo(photos=file_objs, album_id=album_id, group_id=group_id)
+    async def _upload_chunk(cls, upload_url: str, chunk: list, field: str) -> dict:
+        return await cls._get_client().upload(upload_url, files=cls._as_upload_files(chunk, field))
 
     @classmethod
-    async def upload_photos_to_album(cls, file_objs: list, album_id: int, group_id: int = None):
+    async def _upload_concurrently(cls, file_objs: Files, chunk_size: int, field: str,
+                                   server_method: str, **server_params) -> list[dict]:
+        """
+        Грузит пачки файлов на сервер загрузки параллельно (до UPLOAD_CONCURRENCY)
+        и возвращает ответы сервера в исходном порядке. Следующая пачка берется
+        из потока только при свободном слоте, так что в памяти их не больше
+        UPLOAD_CONCURRENCY + 1. Файлы закрываются сразу после загрузки своей пачки.
+        Если пачка не загрузилась, адрес сервера (мог протухнуть в кэше) меняем
+        на новый и повторяем ее один раз.
+        """
+        upload_url = await cls._get_upload_server(server_method, **server_params)
+        refresh_lock = asyncio.Lock()
+        semaphore = asyncio.Semaphore(get_settings().UPLOAD_CONCURRENCY)
+        chunks, tasks = [], []
+
+        async def fresh_url(failed_url: str) -> str:
+            nonlocal upload_url
+            async with refresh_lock:
+                # Параллельные пачки, упавшие на том же адресе, берут уже обновленный
+                if upload_url == failed_url:
+                    cls._forget_upload_server(server_method, **server_params)
+                    upload_url = await cls._get_upload_server(server_method, **server_params)
+                return upload_url
+
+        async def upload(chunk: list) -> dict:
+            url = upload_url
+            try:
+                try:
+                    return await cls._upload_chunk(url, chunk, field)
+                except Exception as e:
+                    logger.warning(f"VK upload failed ({e}), retrying with a new upload server")
+                    return await cls._upload_chunk(await fresh_url(url), chunk, field)
+            finally:
+                cls._close_files(chunk)
+                semaphore.release()
+
+        try:
+            async for chunk in cls._iter_chunks(file_objs, chunk_size):
+                chunks.append(chunk)
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(upload(chunk)))
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            # Сервер мог протухнуть — в следующий раз возьмем новый
+            cls._forget_upload_server(server_method, **server_params)
+            for task in tasks:
+                task.cancel()
+            for chunk in chunks:
+                cls._close_files(chunk)
+            raise
+
+    @classmethod
+    async def _call_batched(cls, method: str, params_list: list[dict]) -> list:
+        """
+        Вызывает метод для каждого набора параметров, упаковывая до 25 вызовов в один execute.
+        Порядок результатов совпадает с порядком параметров.
+        """
+        client = cls._get_client()
+        results = []
+        for i in range(0, len(params_list), EXECUTE_MAX_CALLS):
+            batch = params_list[i:i + EXECUTE_MAX_CALLS]
+            if method in VK_WRITE_METHODS:
+                await RateLimiter.acquire_vk_write()
+            try:
+                responses = await client.call("execute", code=cls._execute_code([(method, p) for p in batch]))
+            except VKAPIError as e:
+                logger.warning(f"VK execute failed ({e}), fallback to single {method}")
+                responses = [None] * len(batch)
+
+            for params, response in zip(batch, responses):
+                # При частичной ошибке execute на месте ответа приходит false
+                if not isinstance(response, list):
+                    response = await client.call(method, **params)
+                results.append(response)
+        return results
+
+    @classmethod
+    async def upload_photos_to_album(cls, file_objs: Files, album_id: int, group_id: int = None):
+        """
+        Загружает фото в альбом: пачки по 5 файлов уходят параллельно по мере поступления,
+        затем все photos.save выполняются пакетно. Порядок фото сохраняется.
+        Файлы переходят во владение сервиса и закрываются после загрузки.
+        """
         try:
-            return await asyncio.to_thread(cls._upload_album_sync, file_objs, album_id, group_id)
+            async with STAGE_SECONDS.time(stage="vk_upload_album"):
+                uploaded = await cls._upload_concurrently(
+                    file_objs, UPLOAD_CHUNK_SIZE, "file{}", "photos.getUploadServer", album_id=album_id, group_id=group_id
+                )
+                saved = await cls._call_batched("photos.save", [
+                    {"album_id": album_id, "group_id": group_id,
+                     "server": u['server'], "photos_list": u['photos_list'], "hash": u['hash']}
+                    for u in uploaded
+                ])
+            return [photo for chunk in saved for photo in chunk]
         except Exception as e:
             logger.error(f"Error uploading: {e}")
             raise e
 
     @classmethod
-    @retry(**RETRY_CONFIG)
-    def _upload_wall_sync(cls, file_objs: list, group_id: int = None):
-        for f in file_objs:
-            if hasattr(f, 'seek'): f.seek(0)
-        upload = VkUpload(cls._session)
-        photos = upload.photo_wall(photos=file_objs, group_id=group_id)
-        return ",".join([f"photo{p['owner_id']}_{p['id']}" for p in photos])
+    async def upload_wall_photo_objects(cls, file_objs: Files, group_id: int = None) -> list[dict]:
+        """Загружает фото для поста параллельно по мере поступления; порядок для сетки сохраняется."""
+        async with STAGE_SECONDS.time(stage="vk_upload_wall"):
+            uploaded = await cls._upload_concurrently(
+                file_objs, 1, "photo", "photos.getWallUploadServer", group_id=group_id
+            )
+            saved = await cls._call_batched("photos.saveWallPhoto", [
+                {"group_id": group_id, "server": u['server'], "photo": u['photo'], "hash": u['hash']}
+                for u in uploaded
+            ])
+        return [photo for chunk in saved for photo in chunk]
 
     @classmethod
-    async def upload_wall_photos(cls, file_objs: list, group_id: int = None):
-        return await asyncio.to_thread(cls._upload_wall_sync, file_objs, group_id)
+    async def upload_wall_photos(cls, file_objs: Files, group_id: int = None):
+        photos = await cls.upload_wall_photo_objects(file_objs, group_id)
+        return ",".join([f"photo{p['owner_id']}_{p['id']}" for p in photos])
 
     @classmethod
-    @retry(**RETRY_CONFIG)
-    def _post_wall_sync(cls, message: str, attachments: str, owner_id: int = None, from_group: bool = False):
+    async def post_to_wall(cls, message: str = "", attachments: str = None, owner_id: int = None,
+                           from_group: bool = False):
         params = {
             "message": message, "attachments": attachments,
             "dont_parse_links": 1, "primary_attachments_mode": "grid"
         }
         if owner_id: params["owner_id"] = owner_id
         if from_group: params["from_group"] = 1
-        return cls._api.wall.post(**params)
-
-    @classmethod
-    async def post_to_wall(cls, message: str = "", attachments: str = None, owner_id: int = None,
-                           from_group: bool = False):
-        return await asyncio.to_thread(cls._post_wall_sync, message, attachments, owner_id, from_group)
\ No newline at end of file
+        return await cls._get_client().call("wall.post", **params)
@@ -2,6 +2,8 @@ from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 
+from app.core.jobs import JobManager
+
 router = Router()
 
 
@@ -13,7 +15,8 @@ async def cmd_start(message: types.Message, state: FSMContext):
     await message.answer(
         "👋 <b>Привет! Я твой VK-помощник.</b>\n\n"
         "Воспользуйся кнопкой <b>Меню</b> слева от поля ввода, чтобы выбрать действие:\n\n"
-        "🔹 <b>/get_album</b> — Скачать фото из альбома ВК\n"
+        "🔹 <b>/get_album</b> — Скачать фото из альбома ВК (<b>/get_album zip</b> — архивом,\n"
+        "      качество: <code>original</code>, <code>telegram-optimal</code>, <code>preview</code>)\n"
         "🔹 <b>/add_life</b> — Загрузить фото в альбом Life is Life\n"
         "🔹 <b>/wall_post</b> — Опубликовать пост на стене",
         parse_mode="HTML"
@@ -25,7 +28,9 @@ async def cmd_start(message: types.Message, state: FSMContext):
 async def cmd_cancel(message: types.Message, state: FSMContext):
     """Хендлер отмены действия"""
     current_state = await state.get_state()
-    if current_state is None:
+    # Останавливаем и фоновые задачи пользователя (например, отправку альбома)
+    cancelled_jobs = await JobManager.cancel(message.from_user.id)
+    if current_state is None and not cancelled_jobs:
         await message.answer("Нечего отменять.")
         return
 
@@ -1,69 +1,296 @@
-import asyncio
-import io
+import re
+
 from aiogram import Router, types, F, Bot
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
-from aiogram.types import InputMediaPhoto, BufferedInputFile
+from aiogram.types import FSInputFile
 from loguru import logger
 
 from app.core.config import get_settings
-from app.core.vk_service import VKService
-from app.core.http_client import download_file
+from app.core.jobs import Job, JobLimitError, JobManager
+from app.core.vk_service import AlbumInfo, PhotoRecord, VKService, QUALITY_PROFILES
+from app.core.vk_client import VKAPIError
+from app.core.checkpoints import AlbumState, Transfer, TransferStore, TransferTracker
+from app.core.album_pipeline import iter_download_batches, send_media_batch
+from app.core.archive import ZipVolume, ZipVolumeWriter, remove_volume
+from app.core.rate_limiter import RateLimiter
+from app.core.dedup import DedupFilter, LIFE_SCOPE, WALL_SCOPE
 from app.states import GetAlbumState, AddLifeState, WallPostState
 
 router = Router()
 
+# Сколько альбомов показываем построчно в статусе выгрузки
+PROGRESS_ALBUMS = 10
+
 
 # ==========================================
 # 1. СЦЕНАРИЙ: /get_album
 # ==========================================
 
 @router.message(Command("get_album"))
-async def start_get_album(message: types.Message, state: FSMContext):
-    await message.answer("🔗 Пришлите ссылку на альбом ВКонтакте.")
+async def start_get_album(message: types.Message, state: FSMContext, command: CommandObject):
+    # /get_album [zip] [original|telegram-optimal|preview]:
+    # zip — отдать альбом ZIP-архивами, второй аргумент — профиль качества
+    args = (command.args or "").lower().split()
+    mode = "zip" if "zip" in args else "photos"
+    quality = next((a for a in args if a in QUALITY_PROFILES), None)
+    if quality is None:
+        quality = "original" if mode == "zip" else get_settings().PHOTO_QUALITY
+    await state.update_data(mode=mode, quality=quality)
+    await message.answer(
+        "🔗 Пришлите ссылку на альбом ВКонтакте.\n"
+        "Можно несколько ссылок сразу или ссылку на все альбомы владельца (vk.com/albums-123, club123, id123)."
+    )
     await state.set_state(GetAlbumState.waiting_for_link)
 
 
 @router.message(GetAlbumState.waiting_for_link, F.text)
 async def process_get_album(message: types.Message, state: FSMContext):
-    link = message.text.strip()
-    owner_id, album_id = VKService.parse_link(link)
-
-    if not owner_id:
-        await message.answer("❌ Некорректная ссылка. Попробуйте еще раз или /cancel")
-        return
+    text = message.text.strip()
+    albums = [AlbumInfo(owner_id, album_id) for owner_id, album_id in VKService.parse_links(text)]
+
+    if not albums:
+        owner_id = VKService.parse_owner(text)
+        if not owner_id:
+            await message.answer("❌ Некорректная ссылка. Попробуйте еще раз или /cancel")
+            return
+        # Выгрузка всех альбомов владельца
+        try:
+            albums = await VKService.get_albums(owner_id)
+        except Exception as e:
+            logger.error(f"Get albums error: {e}")
+            await message.answer("❌ Не удалось получить список альбомов. Попробуйте еще раз или /cancel")
+            return
+        if not albums:
+            await message.answer("Альбомов нет или они закрыты.")
+            await state.clear()
+            return
+
+    data = await state.get_data()
+    transfer = Transfer(
+        id=f"{message.chat.id}_{message.message_id}", albums=[AlbumState(album) for album in albums],
+        mode=data.get("mode", "photos"), quality=data.get("quality", get_settings().PHOTO_QUALITY),
+        message=message.model_dump_json(exclude_none=True, by_alias=True)
+    )
+    # Отправка альбома идет фоновой задачей: хендлер не блокируется, /cancel ее останавливает
+    try:
+        await _submit_transfer(message, _transfer_title(transfer), transfer)
+    except JobLimitError:
+        await message.answer("⏳ У вас уже много задач в очереди. Дождитесь их или /cancel")
+    await state.clear()
 
-    await message.answer("⏳ Сканирую альбом...")
-    urls = await VKService.get_photo_urls(owner_id, album_id)
 
-    if not urls:
-        await message.answer("Альбом пуст или закрыт.")
-        await state.clear()
-        return
+def _transfer_title(transfer: Transfer, resumed: bool = False) -> str:
+    title = "Альбом" if len(transfer.albums) == 1 else f"Альбомы ({len(transfer.albums)})"
+    return f"{title} (продолжение)" if resumed else title
 
-    await message.answer(f"Найдено {len(urls)} фото. Начинаю отправку...")
 
-    # Логика отправки (пачками)
-    media_group = []
-    for i, url in enumerate(urls):
+async def _submit_transfer(message: types.Message, title: str, transfer: Transfer, resumed: bool = False):
+    """
+    Чекпоинт пишется сразу: задача, не успевшая стартовать до рестарта, тоже продолжится.
+    Продолжение после рестарта идет вне лимита задач пользователя, и его чекпоинт
+    при ошибке постановки не удаляется.
+    """
+    if not resumed:
+        TransferStore.create(transfer)
+    try:
+        return await JobManager.submit(
+            message, title, lambda job: send_album(job, message, transfer),
+            on_cancel=lambda: TransferStore.delete(transfer.id), kind="album", limited=not resumed
+        )
+    except Exception:
+        if not resumed:
+            TransferStore.delete(transfer.id)
+        raise
+
+
+async def resume_album_transfers(bot: Bot):
+    """
+    Продолжает отправки альбомов, прерванные рестартом, с их чекпоинтов.
+    Берутся только брошенные чекпоинты: то, что еще ведет другая реплика, не трогаем.
+    """
+    transfers = TransferStore.claim_abandoned()
+    for transfer in transfers:
         try:
-            data = await download_file(url)
-            f = io.BytesIO(data)
-            media = InputMediaPhoto(media=BufferedInputFile(f.getvalue(), filename=f"p_{i}.jpg"))
-            media_group.append(media)
+            message = types.Message.model_validate_json(transfer.message, context={"bot": bot})
+            await _submit_transfer(message, _transfer_title(transfer, resumed=True), transfer, resumed=True)
+        except Exception as e:
+            logger.error(f"Transfers: не удалось продолжить {transfer.id}: {e}")
+            TransferStore.release(transfer.id)
+    if transfers:
+        logger.info(f"Transfers: продолжено отправок альбомов: {len(transfers)}.")
+
+
+async def send_album(job: Job, message: types.Message, transfer: Transfer):
+    """
+    Отправка одного или нескольких альбомов одним конвейером: альбомы сканируются
+    параллельно, фото из нескольких альбомов сразу уходят один раз.
+    """
+    tracker = TransferTracker(transfer)
+    resumed = transfer.scanned > 0
+    await job.progress.update("⏳ Продолжаю отправку альбома..." if resumed else "⏳ Сканирую альбом...", force=True)
+    photos = tracker.photos()
+    try:
+        first = await anext(photos, None)
+    except Exception as e:
+        logger.error(f"Get photos error: {e}")
+        first = None
+
+    if first is None:
+        await photos.aclose()
+        TransferStore.delete(transfer.id)
+        if resumed:
+            await job.progress.finish(f"✅ Отправлено {transfer.done} из {transfer.total} фото.")
+        else:
+            await job.progress.finish("Альбом пуст или закрыт.")
+        return
 
-            if len(media_group) == 10:
-                await message.answer_media_group(media=media_group)
-                media_group = []
-                await asyncio.sleep(1)
-        except Exception:
-            pass
+    job.total = transfer.total
+    job.done = transfer.done
+    await job.progress.update(f"Найдено {job.total} фото. Начинаю отправку...", force=True)
 
-    if media_group:
-        await message.answer_media_group(media=media_group)
+    async def album_photos():
+        yield first
+        async for photo in photos:
+            yield photo
 
+    # Сканирование альбомов идет параллельно с доставкой
+    try:
+        if transfer.mode == "zip":
+            await _deliver_zip(job, message, album_photos(), tracker, name=_archive_name(transfer))
+        else:
+            await _deliver_photos(job, message, album_photos(), tracker)
+    except Exception as e:
+        logger.error(f"Album scan error: {e}")
+        await message.answer("⚠️ Сканирование альбома прервалось, отправлено не всё.")
+    finally:
+        await photos.aclose()
+
+    failures = TransferStore.failures(transfer.id)
+    TransferStore.delete(transfer.id)
+    job.total = transfer.total
+    await job.progress.finish(_progress_text(job, transfer, "✅ Отправлено"))
+    unscanned = [album for album in transfer.albums if album.error]
+    if unscanned:
+        lines = "\n".join(f"• {album.info.name} — {album.error}" for album in unscanned[:5])
+        await message.answer(f"⚠️ Не удалось отсканировать альбомов: {len(unscanned)}\n{lines}")
+    if failures:
+        reasons = "\n".join(f"• {count} — {reason}" for reason, count in failures[:3])
+        await message.answer(f"⚠️ Не удалось отправить {sum(c for _, c in failures)} фото:\n{reasons}")
     await message.answer("✅ Готово!")
-    await state.clear()
+
+
+def _archive_name(transfer: Transfer) -> str:
+    album = transfer.albums[0].info
+    if len(transfer.albums) == 1:
+        return f"album{album.owner_id}_{album.album_id}"
+    return f"albums{album.owner_id}"
+
+
+def _progress_text(job: Job, transfer: Transfer, verb: str) -> str:
+    """Общий счетчик, а для нескольких альбомов — еще и строки по альбомам (не больше PROGRESS_ALBUMS)."""
+    text = f"{verb} {job.done} из {job.total} фото."
+    if len(transfer.albums) == 1:
+        return text
+
+    lines = [text]
+    finished = 0
+    for album in transfer.albums:
+        if album.error:
+            icon = "⚠️"
+        elif album.scanned and album.done >= album.found:
+            icon = "✅"
+            finished += 1
+        else:
+            icon = "⏳" if album.found else "🕓"
+        if len(lines) <= PROGRESS_ALBUMS:
+            lines.append(f"{icon} {album.info.name}: {album.done}/{album.expected}")
+    hidden = len(transfer.albums) - (len(lines) - 1)
+    if hidden > 0:
+        lines.append(f"…и еще альбомов: {hidden}")
+    lines.append(f"Готово альбомов: {finished} из {len(transfer.albums)}")
+    return "\n".join(lines)
+
+
+async def _deliver_photos(job: Job, message: types.Message, photos, tracker: TransferTracker):
+    """Медиагруппы по 10: следующие пачки качаются, пока текущая уходит в Telegram."""
+    async for batch in iter_download_batches(photos, on_failed=tracker.failed):
+        try:
+            # Не скачавшиеся при переотправке фото уходят в неудачи, а не в доставленные
+            sent = await send_media_batch(message, batch, on_failed=tracker.failed)
+        except Exception as e:
+            logger.error(f"Send media group error: {e}")
+            tracker.failed_many([photo for photo, _ in batch], e)
+        else:
+            job.done += len(sent)
+            tracker.delivered(sent, job.done)
+        job.total = tracker.transfer.total
+        await job.progress.update(_progress_text(job, tracker.transfer, "📤 Отправлено"))
+
+
+async def _deliver_zip(job: Job, message: types.Message, photos, tracker: TransferTracker, name: str):
+    """
+    ZIP-архивы в исходном качестве: фото пишутся в архив на диске по мере скачивания,
+    том отправляется документом, как только достигает лимита Bot API.
+    После рестарта нумерация томов продолжается.
+    """
+    writer = ZipVolumeWriter(name, get_settings().ARCHIVE_MAX_BYTES)
+    writer.part = tracker.transfer.parts
+    # Фото текущего тома: доставленными считаются только после отправки тома
+    packed = []
+    try:
+        # Фото крупнее тома не отправить документом — такие считаются неудавшимися
+        async for batch in iter_download_batches(photos, use_file_ids=False, profile="", on_failed=tracker.failed,
+                                                 max_bytes=writer.max_file_bytes):
+            for photo, data in batch:
+                volume = writer.add(_arcname(job, tracker, photo), data)
+                if volume:
+                    # Текущее фото уже легло в новый том
+                    await _send_packed(job, message, volume, packed, tracker, part=writer.part - 1)
+                    packed = []
+                packed.append(photo)
+                job.done += 1
+            job.total = tracker.transfer.total
+            await job.progress.update(_progress_text(job, tracker.transfer, "🗜 Упаковано"))
+
+        volume = writer.close()
+        if volume:
+            await _send_packed(job, message, volume, packed, tracker, part=writer.part)
+    finally:
+        writer.discard()
+
+
+def _arcname(job: Job, tracker: TransferTracker, photo: PhotoRecord) -> str:
+    """Имя фото в архиве; при выгрузке нескольких альбомов каждый — в своей папке."""
+    name = f"{job.done + 1:05d}_{photo.owner_id}_{photo.id}.jpg"
+    album = tracker.album_of(photo)
+    if len(tracker.transfer.albums) == 1 or album is None:
+        return name
+    folder = re.sub(r'[\\/:*?"<>|]+', "_", album.info.name).strip(". ") or album.info.album_id
+    return f"{folder}/{name}"
+
+
+async def _send_packed(job: Job, message: types.Message, volume: ZipVolume,
+                       packed: list[PhotoRecord], tracker: TransferTracker, part: int):
+    try:
+        await _send_volume(message, volume)
+    except Exception as e:
+        logger.error(f"Send volume error: {e}")
+        job.done -= len(packed)
+        tracker.failed_many(packed, e)
+    else:
+        tracker.delivered(packed, job.done, parts=part)
+
+
+async def _send_volume(message: types.Message, volume: ZipVolume):
+    try:
+        document = FSInputFile(volume.path, filename=volume.filename)
+        await RateLimiter.telegram(
+            message.chat.id,
+            lambda: message.answer_document(document, caption=f"🗜 {volume.filename} ({volume.files} фото)")
+        )
+    finally:
+        remove_volume(volume.path)
 
 
 # ==========================================
@@ -94,23 +321,22 @@ async def process_add_life(message: types.Message, state: FSMContext, bot: Bot,
 
     await message.answer("⏳ Загружаю в ВК...")
 
-    file_streams = []
     try:
-        for msg in messages:
-            # Берем лучшее качество
-            file_id = msg.photo[-1].file_id
-            f = io.BytesIO()
-            await bot.download(file_id, destination=f)
-            f.seek(0)
-            f.name = f"img_{file_id}.jpg"  # Важно для vk_api
-            file_streams.append(f)
-
-        await VKService.upload_photos_to_album(
-            file_streams,
+        # Фото качаются из Telegram потоком и сразу уходят в ВК, не копясь в памяти;
+        # уже загруженные в альбом фото отсеиваются до отправки
+        dedup = DedupFilter(LIFE_SCOPE)
+        uploaded = await VKService.upload_photos_to_album(
+            dedup.iter_new_photos(bot, messages, profile=settings.IMAGE_PROFILE_ADD_LIFE),
             album_id=settings.VK_LIFE_ALBUM_ID,
             group_id=settings.VK_LIFE_GROUP_ID
         )
-        await message.answer(f"✅ Успешно загружено {len(messages)} фото в альбом Life is Life!")
+        dedup.commit(uploaded)
+
+        if not uploaded and dedup.skipped:
+            await message.answer("♻️ Все эти фото уже есть в альбоме Life is Life.")
+        else:
+            skipped = f" Пропущено дублей: {dedup.skipped}." if dedup.skipped else ""
+            await message.answer(f"✅ Успешно загружено {len(uploaded)} фото в альбом Life is Life!{skipped}")
 
     except Exception as e:
         logger.error(e)
@@ -134,6 +360,29 @@ async def start_wall_post(message: types.Message, state: FSMContext):
     await state.set_state(WallPostState.waiting_for_content)
 
 
+async def _post_wall_photos(bot: Bot, messages: list[types.Message], caption: str):
+    """
+    Загружает фото на сервер ВК (потоком: скачивание и загрузка идут внахлест) и публикует пост.
+    Точные копии уже загруженных фото не грузим повторно, а прикладываем существующие;
+    если такое фото успели удалить в ВК, забываем его и загружаем заново.
+    """
+    for attempt in range(2):
+        dedup = DedupFilter(WALL_SCOPE, similar=False)
+        uploaded = await VKService.upload_wall_photo_objects(
+            dedup.iter_new_photos(bot, messages, profile=get_settings().IMAGE_PROFILE_WALL_POST)
+        )
+        dedup.commit(uploaded)
+        attachments_str = ",".join(f"photo{p}" for p in dedup.merge_attachments(uploaded, len(messages)))
+        try:
+            return await VKService.post_to_wall(message=caption, attachments=attachments_str)
+        except VKAPIError as e:
+            # 100 — неверный параметр: приложенное из индекса фото больше не существует
+            if e.code != 100 or not dedup.duplicates or attempt:
+                raise
+            logger.warning(f"Wall post: {dedup.skipped} фото из индекса недоступны ({e}), загружаем заново")
+            dedup.forget_duplicates()
+
+
 @router.message(WallPostState.waiting_for_content)
 async def process_wall_post(message: types.Message, state: FSMContext, bot: Bot, album: list[types.Message] = None):
     text_content = message.text or message.caption or ""
@@ -150,23 +399,11 @@ async def process_wall_post(message: types.Message, state: FSMContext, bot: Bot,
         messages = album if album else [message]
         msg_wait = await message.answer(f"⏳ Обработка {len(messages)} фото...")
 
-        file_streams = []
         # Если подпись была у первого фото в альбоме
         caption = messages[0].caption or ""
 
         try:
-            for msg in messages:
-                f = io.BytesIO()
-                await bot.download(msg.photo[-1].file_id, destination=f)
-                f.seek(0)
-                f.name = f"wall_{msg.message_id}.jpg"
-                file_streams.append(f)
-
-            # 1. Загружаем фото на сервер ВК
-            attachments_str = await VKService.upload_wall_photos(file_streams)
-
-            # 2. Публикуем пост
-            await VKService.post_to_wall(message=caption, attachments=attachments_str)
+            await _post_wall_photos(bot, messages, caption)
             await msg_wait.edit_text("✅ Пост с фото опубликован!")
 
         except Exception as e:
@@ -1,13 +1,27 @@
 import asyncio
+import multiprocessing
+import signal
 import sys
+import time
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import BotCommand
 from loguru import logger
 
 from app.core.config import get_settings
 from app.core.http_client import HTTPClient
+from app.core.dedup import DedupIndex
+from app.core.file_id_cache import FileIdCache
+from app.core.health import Health, READY
+from app.core.image_processing import ImageProcessor
+from app.core.jobs import JobManager
+from app.core.metrics import Metrics
+from app.core.shared_state import create_album_store, create_fsm_storage
+from app.core.checkpoints import LEASE_SECONDS, TransferStore
 from app.core.vk_service import VKService
 from app.middlewares.album_middleware import AlbumMiddleware
+from app.middlewares.profiling_middleware import ProfilingMiddleware
 from app.handlers import common, vk_features
 
 
@@ -26,28 +40,81 @@ async def setup_bot_commands(bot: Bot):
     await bot.set_my_commands(commands)
 
 
-async def on_startup(bot: Bot):
+async def warm_up(bot: Bot, resume_transfers: bool = True):
+    """Сетевой прогрев параллельно, пока бот уже принимает апдейты."""
+    await asyncio.gather(
+        # users.get заодно открывает соединение с api.vk.com в пуле HTTPClient;
+        # при сбоях сети VKService.start повторяет его, и vk остается starting, а не failed
+        Health.track("vk", VKService.start()),
+        Health.track("images", ImageProcessor.warm_up()),
+        # А set_my_commands — соединение с Bot API в сессии aiogram
+        Health.track("bot_commands", setup_bot_commands(bot)),
+    )
+    # Индекс дублей заполняется из альбома ВК, поэтому — после прогрева
+    DedupIndex.start_seeding()
+    # Прерванные рестартом отправки альбомов продолжаем, когда ВК и Bot API уже отвечают
+    if not resume_transfers:
+        return
+    await Health.track("transfers", vk_features.resume_album_transfers(bot))
+    # Чекпоинты упавших реплик освобождаются, когда истекает их аренда, — подбираем их и потом
+    while True:
+        await asyncio.sleep(LEASE_SECONDS)
+        try:
+            await vk_features.resume_album_transfers(bot)
+        except Exception as e:
+            logger.error(f"Transfers: ошибка проверки брошенных чекпоинтов: {e}")
+
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher):
     logger.info("🚀 Startup...")
+    started = time.monotonic()
+    await Metrics.start()
+    # Локальные подсистемы поднимаются за миллисекунды и нужны для первого же апдейта
     HTTPClient.get_client()
-    VKService.start()
+    FileIdCache.open()
+    ImageProcessor.start()
+    DedupIndex.open()
+    TransferStore.open()
+    VKService.init()
+    JobManager.start()
+    Health.set("core", READY)
 
+    dispatcher["warm_up_task"] = asyncio.create_task(
+        warm_up(bot, resume_transfers=dispatcher.get("resume_transfers", True))
+    )
+    logger.info(f"🚀 Готов принимать апдейты за {time.monotonic() - started:.3f} c, прогрев идет фоном")
 
-async def on_shutdown(bot: Bot):
+
+async def on_shutdown(bot: Bot, dispatcher: Dispatcher):
     logger.info("🛑 Shutdown...")
+    warm_up_task = dispatcher.get("warm_up_task")
+    if warm_up_task:
+        warm_up_task.cancel()
+    await JobManager.stop()
     await HTTPClient.close()
+    FileIdCache.close()
+    DedupIndex.close()
+    TransferStore.close()
+    ImageProcessor.stop()
+    await Metrics.stop()
 
 
-async def main():
-    logger.remove()
-    logger.add(sys.stderr, level="INFO", format="<green>{time:HH:mm:ss}</green> | <level>{message}</level>")
-
+def create_bot() -> Bot:
     settings = get_settings()
-    bot = Bot(token=settings.TG_TOKEN.get_secret_value())
-    dp = Dispatcher()
+    session = None
+    if settings.TG_API_SERVER:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.TG_API_SERVER))
+    return Bot(token=settings.TG_TOKEN.get_secret_value(), session=session)
+
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=create_fsm_storage())
 
     # Подключаем Middleware для обработки альбомов
     # Он будет склеивать группы фото в один список
-    dp.message.middleware(AlbumMiddleware())
+    dp.message.middleware(AlbumMiddleware(store=create_album_store()))
+    # Профилирование апдейта, если его включили через /debug/profile
+    dp.update.outer_middleware(ProfilingMiddleware())
 
     # Подключаем роутеры
     dp.include_router(common.router)
@@ -55,13 +122,108 @@ async def main():
 
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
+    return dp
+
+
+def setup_logging():
+    logger.remove()
+    logger.add(sys.stderr, level="INFO", format="<green>{time:HH:mm:ss}</green> | <level>{message}</level>")
+
+
+async def run_polling():
+    bot = create_bot()
+    dp = create_dispatcher()
 
     await bot.delete_webhook(drop_pending_updates=True)
     await dp.start_polling(bot)
 
 
+# ==========================================
+# WEBHOOK: несколько процессов на одном порту
+# ==========================================
+
+async def set_webhook():
+    settings = get_settings()
+    if not settings.WEBHOOK_URL:
+        logger.info("Webhook: WEBHOOK_URL не задан, считаем вебхук уже установленным.")
+        return
+    bot = create_bot()
+    secret = settings.WEBHOOK_SECRET.get_secret_value() if settings.WEBHOOK_SECRET else None
+    try:
+        await bot.set_webhook(
+            settings.WEBHOOK_URL.rstrip("/") + settings.WEBHOOK_PATH, secret_token=secret, drop_pending_updates=True
+        )
+    finally:
+        await bot.session.close()
+    logger.info(f"Webhook: установлен на {settings.WEBHOOK_URL}{settings.WEBHOOK_PATH}")
+
+
+def run_webhook_worker(index: int):
+    """Один процесс-воркер: свой event loop, свои пулы, общий порт (SO_REUSEPORT)."""
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+    from aiohttp import web
+
+    setup_logging()
+    settings = get_settings()
+    # Лимиты ВК и Telegram общие на токен — делим их между воркерами,
+    # а метрики каждого воркера слушают свой порт
+    settings.VK_RATE /= settings.WEB_WORKERS
+    settings.VK_WRITE_RATE /= settings.WEB_WORKERS
+    settings.TG_GLOBAL_RATE /= settings.WEB_WORKERS
+    settings.METRICS_PORT += index
+
+    bot = create_bot()
+    dp = create_dispatcher()
+    # Чекпоинты альбомов общие на DATA_DIR — брошенные подбирает только первый воркер
+    dp["resume_transfers"] = index == 0
+    app = web.Application()
+    secret = settings.WEBHOOK_SECRET.get_secret_value() if settings.WEBHOOK_SECRET else None
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=settings.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    # Пробы для оркестратора на публичном порту вебхука
+    Health.register(app)
+
+    logger.info(f"Webhook[{index}]: слушаем {settings.WEBHOOK_HOST}:{settings.WEBHOOK_PORT}{settings.WEBHOOK_PATH}")
+    web.run_app(app, host=settings.WEBHOOK_HOST, port=settings.WEBHOOK_PORT, reuse_port=True, print=None)
+
+
+def run_webhook():
+    settings = get_settings()
+    if settings.WEB_WORKERS > 1 and settings.STATE_STORAGE == "memory":
+        logger.warning("Webhook: при WEB_WORKERS > 1 нужен STATE_STORAGE=sqlite, иначе FSM и альбомы развалятся.")
+    asyncio.run(set_webhook())
+
+    if settings.WEB_WORKERS == 1:
+        run_webhook_worker(0)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=run_webhook_worker, args=(i,)) for i in range(settings.WEB_WORKERS)]
+    # docker stop шлет SIGTERM только главному процессу — передаем его воркерам
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+def main():
+    setup_logging()
+    if get_settings().BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(run_polling())
+
+
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        main()
     except KeyboardInterrupt:
         pass
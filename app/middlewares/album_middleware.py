@@ -1,39 +1,65 @@
-import asyncio
-from typing import Any, Dict, Union
+import time
+from typing import Any, Dict
 from aiogram import BaseMiddleware
 from aiogram.types import Message
+from loguru import logger
+
+from app.core.metrics import ALBUM_ASSEMBLY_SECONDS
+from app.core.shared_state import AlbumStore, MemoryAlbumStore
+
+# В медиагруппе Telegram не бывает больше 10 элементов
+MAX_MEDIA_GROUP_SIZE = 10
+
 
 class AlbumMiddleware(BaseMiddleware):
-    def __init__(self, latency: float = 0.5):
-        self.latency = latency
-        self.album_data = {}
+    """
+    Склеивает части медиагруппы в один список data["album"].
+
+    Ожидание адаптивное: таймер сбрасывается на каждой новой части (idle),
+    но не дольше max_wait от первой части, а полная группа из 10 фото
+    отдается сразу. Части копятся в store: в памяти процесса или в общем
+    хранилище, если апдейты разбираются несколькими воркерами (см. shared_state).
+    """
+
+    def __init__(self, idle: float = 0.2, max_wait: float = 1.0, store: AlbumStore = None):
+        self.idle = idle
+        self.max_wait = max_wait
+        self.store = store or MemoryAlbumStore()
 
     async def __call__(self, handler, event: Message, data: Dict[str, Any]) -> Any:
         if not event.media_group_id:
             return await handler(event, data)
 
         key = event.media_group_id
-
-        if key not in self.album_data:
-            self.album_data[key] = {
-                "messages": [event],
-                "event": asyncio.Event()
-            }
-            # Ждем немного, пока придут остальные фото
-            await asyncio.sleep(self.latency)
-            self.album_data[key]["event"].set()
-        else:
-            self.album_data[key]["messages"].append(event)
-            # Ждем пока первый поток разблокируется
-            await self.album_data[key]["event"].wait()
-            # Для остальных сообщений группы мы не вызываем handler,
-            # так как первый поток обработает весь список.
+        # Для остальных сообщений группы мы не вызываем handler,
+        # так как первый поток обработает весь список.
+        if not await self.store.join(key, event):
             return
 
-        # Первый поток забирает список и очищает словарь
-        if key in self.album_data:
-            messages = self.album_data[key]["messages"]
-            del self.album_data[key]
-            # Кладем список сообщений в data, чтобы хендлер его увидел
-            data["album"] = messages
-            return await handler(event, data)
\ No newline at end of file
+        started = time.monotonic()
+        try:
+            await self._collect(key, deadline=started + self.max_wait)
+        finally:
+            # Даже если что-то пошло не так, группа не остается висеть в хранилище
+            messages = await self.store.pop(key, data["bot"])
+
+        elapsed = time.monotonic() - started
+        ALBUM_ASSEMBLY_SECONDS.observe(elapsed)
+        logger.debug(f"AlbumMiddleware: группа из {len(messages)} частей собрана за {elapsed:.3f} c")
+
+        # Кладем список сообщений в data, чтобы хендлер его увидел
+        # (группу могли вытеснить из хранилища — тогда отдаем хотя бы свою часть)
+        data["album"] = sorted(messages or [event], key=lambda m: m.message_id)
+        return await handler(event, data)
+
+    async def _collect(self, key: str, deadline: float):
+        """Ждем следующие части, пока они приходят чаще idle и не вышел общий лимит."""
+        count = 1
+        while count < MAX_MEDIA_GROUP_SIZE:
+            timeout = min(self.idle, deadline - time.monotonic())
+            if timeout <= 0:
+                return
+            new_count = await self.store.wait(key, count, timeout)
+            if new_count <= count:
+                return
+            count = new_count
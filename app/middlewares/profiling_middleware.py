@@ -0,0 +1,24 @@
+from typing import Any, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from app.core.metrics import Profiler, profiling_requested
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """
+    Профилирует обработку одного апдейта, если профилирование взведено
+    (POST /debug/profile на порту метрик). Фоновая задача, поставленная
+    этим апдейтом, профилируется тоже (см. JobManager).
+    """
+
+    async def __call__(self, handler, event: Update, data: Dict[str, Any]) -> Any:
+        if not Profiler.take():
+            return await handler(event, data)
+
+        token = profiling_requested.set(True)
+        try:
+            async with Profiler.profile(f"update{event.update_id}"):
+                return await handler(event, data)
+        finally:
+            profiling_requested.reset(token)
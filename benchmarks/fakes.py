@@ -0,0 +1,296 @@
+import asyncio
+import io
+import itertools
+import json
+import os
+import random
+import re
+import time
+from collections import defaultdict
+from dataclasses import dataclass, asdict
+
+from aiohttp import web
+
+try:
+    from PIL import Image
+except ImportError:  # Без Pillow CDN отдает просто случайные байты
+    Image = None
+
+# Номера альбомов и владельцев кодируют число фото (см. FakeServers)
+ALBUM_ID_BASE = 1_000_000
+# По сколько фото в альбомах владельца для photos.getAlbums
+ALBUM_SIZE = 100
+
+
+@dataclass
+class FakeConfig:
+    latency: float = 0.01      # Задержка ответа каждого сервера, сек
+    jitter: float = 0.5        # Разброс задержки: latency * (1 ± jitter)
+    vk_rate: float = 0         # Запросов VK API в секунду, сверх — ошибка 6 (0 — без лимита)
+    tg_chat_rate: float = 0    # Запросов Bot API в секунду на чат, сверх — 429 (0 — без лимита)
+    error_rate: float = 0.0    # Доля запросов, на которые сервер отвечает ошибкой
+    photo_side: int = 1280     # Большая сторона фото на CDN и в Telegram
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def make_jpeg(side: int) -> bytes:
+    """Фото с шумом, чтобы размер файла был похож на настоящий."""
+    if Image is None:
+        return b"\xff\xd8" + os.urandom(side * side // 8) + b"\xff\xd9"
+    small = Image.frombytes("RGB", (side // 8, side * 3 // 32), os.urandom(side // 8 * (side * 3 // 32) * 3))
+    out = io.BytesIO()
+    small.resize((side, side * 3 // 4)).save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+class _Window:
+    """Счетчик запросов за скользящую секунду."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.hits: dict[object, list[float]] = defaultdict(list)
+
+    def allow(self, key=None) -> bool:
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        hits = self.hits[key]
+        while hits and hits[0] <= now - 1:
+            hits.pop(0)
+        if len(hits) >= self.rate:
+            return False
+        hits.append(now)
+        return True
+
+
+class FakeServers:
+    """
+    Заглушки VK API, сервера загрузки ВК, CDN и Telegram Bot API на одном порту.
+    Альбом album{owner}_{N} содержит N фото, так что размер сценария задается ссылкой.
+    Для N больше миллиона размер — N % 1_000_000, а номера фото начинаются с N - размер:
+    так у владельца бывают разные альбомы одного размера.
+    Владелец с ID вида K * 1_000_000 + N (photos.getAlbums) — это N фото в альбомах
+    по ALBUM_SIZE плюс альбом, повторяющий начало первого (дубли между альбомами).
+    """
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.base_url = ""
+        self.photo = make_jpeg(config.photo_side)
+        self.stats: dict[str, int] = defaultdict(int)
+        self._vk_window = _Window(config.vk_rate)
+        self._tg_window = _Window(config.tg_chat_rate)
+        self._ids = itertools.count(1)
+        self._runner: web.AppRunner = None
+
+    # --- ОБЩЕЕ ---
+    async def _delay(self):
+        if self.config.latency:
+            jitter = self.config.jitter
+            await asyncio.sleep(self.config.latency * random.uniform(1 - jitter, 1 + jitter))
+
+    def _fail(self) -> bool:
+        return random.random() < self.config.error_rate
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/method/{method}", self._vk_method)
+        app.router.add_post("/upload/{kind}", self._vk_upload)
+        app.router.add_get("/cdn/{name}", self._cdn)
+        app.router.add_post("/bot{token}/{method}", self._tg_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._tg_file)
+        app.router.add_get("/stats", self._stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    # --- VK API ---
+    def _photo_item(self, owner_id: int, photo_id: int) -> dict:
+        url = f"{self.base_url}/cdn/{owner_id}_{photo_id}"
+        return {
+            "id": photo_id, "owner_id": owner_id, "album_id": 0, "date": 0,
+            "sizes": [
+                {"type": t, "width": side, "height": side * 3 // 4, "url": f"{url}_{t}.jpg"}
+                for t, side in (("x", 604), ("y", 807), ("z", 1080), ("w", 2560))
+            ],
+        }
+
+    def _photos_get(self, params: dict) -> dict:
+        owner_id = int(params.get("owner_id", 1))
+        album = str(params.get("album_id", "0"))
+        number = int(album) if album.isdigit() else 0
+        total = number % ALBUM_ID_BASE
+        first = number - total
+        offset = int(params.get("offset", 0))
+        count = int(params.get("count", 50))
+        if params.get("rev") in (1, "1"):
+            ids = range(total, max(total - count, 0), -1)
+        else:
+            ids = range(offset + 1, min(offset + count, total) + 1)
+        return {"count": total, "items": [self._photo_item(owner_id, first + i) for i in ids]}
+
+    @staticmethod
+    def _albums_get(params: dict) -> dict:
+        photos = abs(int(params.get("owner_id", 0))) % ALBUM_ID_BASE
+        sizes = [min(ALBUM_SIZE, photos - i) for i in range(0, photos, ALBUM_SIZE)]
+        items = [{"id": (k + 1) * ALBUM_ID_BASE + size, "title": f"Альбом {k + 1}", "size": size}
+                 for k, size in enumerate(sizes)]
+        if sizes:
+            half = sizes[0] // 2 or 1
+            items.append({"id": ALBUM_ID_BASE + half, "title": "Избранное", "size": half})
+        return {"count": len(items), "items": items}
+
+    def _saved_photos(self, count: int, owner_id: int = 1) -> list[dict]:
+        return [{"id": next(self._ids), "owner_id": owner_id} for _ in range(count)]
+
+    def _call(self, method: str, params: dict):
+        if method == "users.get":
+            return [{"id": 1, "first_name": "Bench"}]
+        if method in ("photos.get", "photos.getUserPhotos"):
+            return self._photos_get(params)
+        if method == "photos.getAlbums":
+            return self._albums_get(params)
+        if method == "photos.getUploadServer":
+            return {"upload_url": f"{self.base_url}/upload/album", "album_id": params.get("album_id")}
+        if method == "photos.getWallUploadServer":
+            return {"upload_url": f"{self.base_url}/upload/wall"}
+        if method == "photos.save":
+            self.stats["vk_saved"] += len(json.loads(params["photos_list"]))
+            return self._saved_photos(len(json.loads(params["photos_list"])))
+        if method == "photos.saveWallPhoto":
+            self.stats["vk_saved"] += 1
+            return self._saved_photos(1)
+        if method == "wall.post":
+            self.stats["vk_posts"] += 1
+            return {"post_id": next(self._ids)}
+        if method == "execute":
+            return self._execute(params["code"])
+        raise KeyError(method)
+
+    def _execute(self, code: str) -> list:
+        """Понимает ровно тот VKScript, который собирает VKService._execute_code."""
+        decoder = json.JSONDecoder()
+        results = []
+        for match in re.finditer(r"API\.([\w.]+)\(", code):
+            params, end = decoder.raw_decode(code, match.end())
+            result = self._call(match.group(1), params)
+            if code.startswith(".items", end + 1):
+                result = result["items"]
+            results.append(result)
+        return results
+
+    async def _vk_method(self, request: web.Request) -> web.Response:
+        await self._delay()
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.stats[f"vk:{method}"] += 1
+        if not self._vk_window.allow():
+            self.stats["vk_rate_limited"] += 1
+            return web.json_response({"error": {"error_code": 6, "error_msg": "Too many requests per second"}})
+        if self._fail():
+            self.stats["vk_errors"] += 1
+            return web.json_response({"error": {"error_code": 10, "error_msg": "Internal server error"}})
+        return web.json_response({"response": self._call(method, params)})
+
+    async def _vk_upload(self, request: web.Request) -> web.Response:
+        await self._delay()
+        form = await request.post()
+        files = [v for k, v in form.items() if k.startswith(("file", "photo"))]
+        self.stats["vk_uploaded_files"] += len(files)
+        if self._fail():
+            self.stats["upload_errors"] += 1
+            return web.Response(status=500)
+        photos_list = json.dumps([{"photo": f"p{i}"} for i in range(len(files))])
+        if request.match_info["kind"] == "wall":
+            return web.json_response({"server": 1, "photo": photos_list, "hash": "h"})
+        return web.json_response({"server": 1, "photos_list": photos_list, "hash": "h", "aid": 1})
+
+    # --- CDN ---
+    async def _cdn(self, request: web.Request) -> web.StreamResponse:
+        await self._delay()
+        self.stats["cdn_requests"] += 1
+        if self._fail():
+            self.stats["cdn_errors"] += 1
+            return web.Response(status=500)
+        start = 0
+        match = re.match(r"bytes=(\d+)-", request.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            return web.Response(body=self.photo[start:], status=206, content_type="image/jpeg")
+        return web.Response(body=self.photo, content_type="image/jpeg")
+
+    # --- TELEGRAM BOT API ---
+    def _message(self, chat_id, **extra) -> dict:
+        return {
+            "message_id": next(self._ids), "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"}, **extra
+        }
+
+    def _photo_sizes(self) -> list[dict]:
+        n = next(self._ids)
+        side = self.config.photo_side
+        return [{
+            "file_id": f"sent{n}", "file_unique_id": f"sent{n}",
+            "width": side, "height": side * 3 // 4, "file_size": len(self.photo)
+        }]
+
+    def _tg_call(self, method: str, form) -> object:
+        chat_id = form.get("chat_id", 0)
+        if method == "sendMediaGroup":
+            media = json.loads(form["media"])
+            self.stats["tg_photos_sent"] += len(media)
+            return [self._message(chat_id, photo=self._photo_sizes(), media_group_id="1") for _ in media]
+        if method == "sendPhoto":
+            self.stats["tg_photos_sent"] += 1
+            return self._message(chat_id, photo=self._photo_sizes())
+        if method == "sendDocument":
+            self.stats["tg_documents_sent"] += 1
+            return self._message(chat_id, document={"file_id": "doc", "file_unique_id": "doc"})
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(chat_id, text=form.get("text", ""))
+        if method == "getFile":
+            file_id = form["file_id"]
+            return {
+                "file_id": file_id, "file_unique_id": file_id,
+                "file_size": len(self.photo), "file_path": f"photos/{file_id}.jpg"
+            }
+        return True
+
+    async def _tg_method(self, request: web.Request) -> web.Response:
+        await self._delay()
+        method = request.match_info["method"]
+        form = await request.post()
+        self.stats[f"tg:{method}"] += 1
+        # Лимит Telegram — на сообщения в чат; getFile и прочие методы без чата не ограничиваем
+        if "chat_id" in form and not self._tg_window.allow(form["chat_id"]):
+            self.stats["tg_rate_limited"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1}
+            }, status=429)
+        if self._fail():
+            self.stats["tg_errors"] += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500)
+        return web.json_response({"ok": True, "result": self._tg_call(method, form)})
+
+    async def _tg_file(self, request: web.Request) -> web.Response:
+        await self._delay()
+        self.stats["tg_files_downloaded"] += 1
+        # Хвост после JPEG не мешает декодеру, но делает каждый файл уникальным по sha256
+        return web.Response(body=self.photo + request.match_info["path"].encode(), content_type="image/jpeg")
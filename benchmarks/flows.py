@@ -0,0 +1,162 @@
+"""
+Сценарии бенчмарка. Выполняются в отдельном процессе бота: настоящий
+Dispatcher, хендлеры и сервисы, только API — локальные заглушки (см. fakes.py).
+"""
+import asyncio
+import itertools
+import resource
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import SendMediaGroup
+from aiogram.types import Update
+from loguru import logger
+
+from app.core.jobs import JobManager
+from app.main import create_bot, create_dispatcher
+from benchmarks.fakes import ALBUM_ID_BASE
+
+# Фото в одной медиагруппе (единица работы во всех сценариях)
+GROUP_SIZE = 10
+
+
+class DeliveryRecorder(BaseRequestMiddleware):
+    """Засекает отправку медиагрупп: время с предыдущей отправки в тот же чат."""
+
+    def __init__(self):
+        self.last: dict[int, float] = {}
+        self.samples: list[float] = []
+
+    def mark(self, chat_id: int):
+        self.last[chat_id] = time.perf_counter()
+
+    async def __call__(self, make_request, bot, method):
+        result = await make_request(bot, method)
+        if isinstance(method, SendMediaGroup):
+            now = time.perf_counter()
+            chat_id = int(method.chat_id)
+            self.samples.append(now - self.last.get(chat_id, now))
+            self.last[chat_id] = now
+        return result
+
+
+class Flow:
+    def __init__(self, bot: Bot, dp: Dispatcher, users: int):
+        self.bot = bot
+        self.dp = dp
+        self.users = users
+        self.recorder = DeliveryRecorder()
+        bot.session.middleware(self.recorder)
+        self._ids = itertools.count(1)
+        # Апдейты, обработка которых упала (при поллинге aiogram их только логирует)
+        self.failed_updates = 0
+
+    async def _feed(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.failed_updates += 1
+            logger.debug(f"Bench: апдейт {update.update_id} упал: {e}")
+
+    def _message(self, user_id: int, **fields) -> Update:
+        message_id = next(self._ids)
+        return Update.model_validate({
+            "update_id": message_id,
+            "message": {
+                "message_id": message_id, "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                **fields,
+            },
+        })
+
+    async def send_text(self, user_id: int, text: str):
+        await self._feed(self._message(user_id, text=text))
+
+    async def send_photos(self, user_id: int, count: int) -> float:
+        """Медиагруппа из count фото; все части приходят одновременно, как от Telegram."""
+        group_id = str(next(self._ids))
+        updates = []
+        for _ in range(count):
+            n = next(self._ids)
+            updates.append(self._message(user_id, media_group_id=group_id, photo=[{
+                "file_id": f"in{n}", "file_unique_id": f"in{n}", "width": 1280, "height": 960, "file_size": 200_000
+            }]))
+        started = time.perf_counter()
+        await asyncio.gather(*(self._feed(u) for u in updates))
+        return time.perf_counter() - started
+
+    @staticmethod
+    async def wait_jobs():
+        while JobManager.queued_count() or JobManager.running_count():
+            await asyncio.sleep(0.01)
+
+    def _user_groups(self, photos: int) -> list[list[int]]:
+        """Раскладывает медиагруппы по пользователям по кругу."""
+        groups = [min(GROUP_SIZE, photos - i) for i in range(0, photos, GROUP_SIZE)]
+        return [groups[u::self.users] for u in range(self.users)]
+
+    # --- СЦЕНАРИИ ---
+    async def get_album(self, photos: int) -> list[float]:
+        """Каждый пользователь скачивает свой альбом; задержка — интервал между медиагруппами."""
+        for user_id, groups in enumerate(self._user_groups(photos), start=1):
+            if not groups:
+                continue
+            await self.send_text(user_id, "/get_album")
+            self.recorder.mark(user_id)
+            await self.send_text(user_id, f"https://vk.com/album{user_id}_{sum(groups)}")
+        await self.wait_jobs()
+        return self.recorder.samples
+
+    async def bulk(self, photos: int) -> list[float]:
+        """Выгрузка всех альбомов владельца: альбомы по 100 фото плюс альбом из дублей."""
+        for user_id, groups in enumerate(self._user_groups(photos), start=1):
+            if not groups:
+                continue
+            await self.send_text(user_id, "/get_album")
+            self.recorder.mark(user_id)
+            await self.send_text(user_id, f"https://vk.com/albums-{user_id * ALBUM_ID_BASE + sum(groups)}")
+        await self.wait_jobs()
+        return self.recorder.samples
+
+    async def _upload_flow(self, command: str, photos: int) -> list[float]:
+        """Каждая медиагруппа — отдельный запрос: команда и фото. Задержка — обработка медиагруппы."""
+        samples = []
+
+        async def user_session(user_id: int, groups: list[int]):
+            for size in groups:
+                await self.send_text(user_id, command)
+                samples.append(await self.send_photos(user_id, size))
+
+        groups = self._user_groups(photos)
+        await asyncio.gather(*(user_session(u, g) for u, g in enumerate(groups, start=1) if g))
+        return samples
+
+    async def add_life(self, photos: int) -> list[float]:
+        return await self._upload_flow("/add_life", photos)
+
+    async def wall_post(self, photos: int) -> list[float]:
+        return await self._upload_flow("/wall_post", photos)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_flow(name: str, photos: int, users: int) -> dict:
+    bot = create_bot()
+    dp = create_dispatcher()
+    flow = Flow(bot, dp, users)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        started = time.perf_counter()
+        samples = await getattr(flow, name)(photos)
+        elapsed = time.perf_counter() - started
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+    return {
+        "seconds": elapsed, "samples": samples, "failed_updates": flow.failed_updates, "peak_rss_mb": peak_rss_mb()
+    }
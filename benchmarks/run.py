@@ -0,0 +1,190 @@
+"""
+Офлайн-бенчмарк сценариев бота на локальных заглушках VK и Telegram.
+
+    python -m benchmarks.run                              # все сценарии на 100 и 1000 фото
+    python -m benchmarks.run --sizes 100 1000 10000 --flows get_album bulk
+    python -m benchmarks.run --latency 0.05 --vk-rate 3 --error-rate 0.01
+    python -m benchmarks.run --save                       # записать результаты как базовые
+
+Каждый сценарий идет в отдельном процессе (честный пик RSS), заглушки — в этом.
+Задержка (p50/p99) — на медиагруппу из 10 фото: для /get_album (и bulk — выгрузки
+всех альбомов владельца) это интервал между отправками медиагрупп, для /add_life
+и /wall_post — обработка присланной медиагруппы целиком. С базовыми значениями
+сравниваются только прогоны с теми же параметрами заглушек; регрессия сверх
+--tolerance дает код выхода 1.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.fakes import FakeConfig, FakeServers
+
+FLOWS = ("get_album", "bulk", "add_life", "wall_post")
+BASELINES = Path(__file__).with_name("baselines.json")
+
+# Что считаем доставленным фото в каждом сценарии (счетчики заглушек)
+DELIVERED_STAT = {"get_album": "tg_photos_sent", "bulk": "tg_photos_sent", "add_life": "vk_saved", "wall_post": "vk_saved"}
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+def _child_env(args, base_url: str, data_dir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "TG_TOKEN": "42:bench", "VK_TOKEN": "bench",
+        "VK_API_URL": f"{base_url}/method/", "TG_API_SERVER": base_url,
+        "VK_LIFE_ALBUM_ID": "1", "DATA_DIR": data_dir,
+        "METRICS_ENABLED": "false", "HTTP2": "false",
+        "DEDUP_ENABLED": str(args.dedup).lower(), "DEDUP_PHASH": "false",
+        "JOB_PROGRESS_INTERVAL": "1000",
+    })
+    # Без лимита на заглушке снимаем и собственный лимит бота, чтобы мерить код, а не паузы.
+    # С лимитом (--vk-rate, --tg-chat-rate) бот работает со своими настройками из .env
+    if not args.vk_rate:
+        env.update({"VK_RATE": "1000", "VK_WRITE_RATE": "1000"})
+    if not args.tg_chat_rate:
+        env.update({"TG_GLOBAL_RATE": "1000", "TG_CHAT_RATE": "1000", "TG_CHAT_BURST": "1000"})
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+async def _run_child(args, flow: str, photos: int, base_url: str) -> dict:
+    with tempfile.TemporaryDirectory() as data_dir:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "benchmarks.run", "--child", flow, str(photos), "--users", str(args.users),
+            env=_child_env(args, base_url, data_dir), stdout=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), args.timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            raise RuntimeError(f"{flow}@{photos}: не уложился в {args.timeout} c")
+    if proc.returncode:
+        raise RuntimeError(f"{flow}@{photos}: процесс завершился с кодом {proc.returncode}")
+    return json.loads(stdout.decode().strip().splitlines()[-1])
+
+
+async def run_all(args) -> dict:
+    config = FakeConfig(
+        latency=args.latency, vk_rate=args.vk_rate, tg_chat_rate=args.tg_chat_rate,
+        error_rate=args.error_rate, photo_side=args.photo_side
+    )
+    fakes = FakeServers(config)
+    base_url = await fakes.start()
+    results = {}
+    try:
+        for flow in args.flows:
+            for photos in args.sizes:
+                before = dict(fakes.stats)
+                raw = await _run_child(args, flow, photos, base_url)
+                stat = DELIVERED_STAT[flow]
+                delivered = fakes.stats[stat] - before.get(stat, 0)
+                result = {
+                    "photos": photos,
+                    "delivered": delivered,
+                    "seconds": round(raw["seconds"], 3),
+                    "throughput": round(delivered / raw["seconds"], 2) if raw["seconds"] else 0.0,
+                    "p50": round(_percentile(raw["samples"], 50), 4),
+                    "p99": round(_percentile(raw["samples"], 99), 4),
+                    "peak_rss_mb": round(raw["peak_rss_mb"], 1),
+                    "failed_updates": raw["failed_updates"],
+                }
+                results[f"{flow}:{photos}"] = result
+                print(
+                    f"{flow:>10} {photos:>6} фото: {result['throughput']:>8} фото/с, "
+                    f"p50 {result['p50']:.3f} c, p99 {result['p99']:.3f} c, "
+                    f"RSS {result['peak_rss_mb']} МБ, доставлено {delivered}, {result['seconds']} c, "
+                    f"упавших апдейтов {result['failed_updates']}"
+                )
+    finally:
+        await fakes.stop()
+    return {"config": {**config.as_dict(), "users": args.users, "dedup": args.dedup}, "results": results}
+
+
+def compare(report: dict, tolerance: float) -> list[str]:
+    """Регрессии относительно baselines.json: пропускная способность ниже, p99 или RSS выше."""
+    if not BASELINES.exists():
+        return []
+    baseline = json.loads(BASELINES.read_text())
+    if baseline.get("config") != report["config"]:
+        print("Базовые значения сняты с другими параметрами заглушек, сравнение пропущено.")
+        return []
+
+    regressions = []
+    for key, result in report["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {base['throughput']} -> {result['throughput']}")
+        for metric in ("p99", "peak_rss_mb"):
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{key}: {metric} {base[metric]} -> {result[metric]}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк сценариев бота")
+    parser.add_argument("--flows", nargs="+", choices=FLOWS, default=list(FLOWS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument("--users", type=int, default=10, help="одновременных пользователей")
+    parser.add_argument("--latency", type=float, default=0.01, help="задержка заглушек, сек")
+    parser.add_argument("--vk-rate", type=float, default=0, help="лимит VK API, запросов/сек")
+    parser.add_argument("--tg-chat-rate", type=float, default=0, help="лимит Bot API на чат, запросов/сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой")
+    parser.add_argument("--photo-side", type=int, default=1280)
+    parser.add_argument("--dedup", action="store_true", help="включить DedupFilter (sha256)")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE для настроек бота")
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение (доля)")
+    parser.add_argument("--save", action="store_true", help="записать результаты в baselines.json")
+    parser.add_argument("--child", nargs=2, metavar=("FLOW", "PHOTOS"), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    if args.child:
+        from loguru import logger
+        from benchmarks.flows import run_flow
+
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        flow, photos = args.child
+        print(json.dumps(asyncio.run(run_flow(flow, int(photos), args.users))))
+        return 0
+
+    # Обрывы соединений клиентами на заглушках — не ошибки бенчмарка
+    logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+    report = asyncio.run(run_all(args))
+    if args.save:
+        baseline = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+        if baseline.get("config") == report["config"]:
+            report["results"] = {**baseline["results"], **report["results"]}
+        BASELINES.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+        print(f"Базовые значения записаны в {BASELINES}")
+        return 0
+
+    regressions = compare(report, args.tolerance)
+    for line in regressions:
+        print(f"РЕГРЕССИЯ {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())